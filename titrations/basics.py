@@ -1,10 +1,14 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../basics.ipynb.
 
 # %% auto 0
-__all__ = ['VALID_PARAMETERS', 'MedicationClass', 'Ingredient', 'Medication', 'Reaction', 'Patient']
+__all__ = ['VALID_PARAMETERS', 'NUMERIC_PARAMETERS', 'PREDICATE_OPERATIONS', 'DOSES_PER_DAY', 'Range', 'Interval', 'ValueSet',
+           'as_predicate', 'within', 'Dose', 'dose_amount_key', 'MedicationClass', 'Ingredient', 'Medication',
+           'Reaction', 'Patient', 'MedicationInterner', 'IndexedPatient']
 
 # %% ../basics.ipynb 1
 from typing import List, Dict, Optional
+from functools import lru_cache, total_ordering
+import re
 
 # %% ../basics.ipynb 2
 VALID_PARAMETERS = [
@@ -13,46 +17,222 @@ VALID_PARAMETERS = [
     'severe_gu_infxns', 'has_type_1_diabetes', 'has_type_2_diabetes_on_insulin',
     ]
 
+# The labs and vitals; the other parameters are boolean flags
+NUMERIC_PARAMETERS = ['SBP', 'HR', 'K', 'Cr', 'eGFR']
+
 # %% ../basics.ipynb 3
+class Range:
+    """
+    A closed band `[low, high]` over a continuous value. Membership is two comparisons, so it does
+    not depend on how the value was rounded (unlike a list of allowed values).
+    """
+    __slots__ = ('low', 'high')
+    closed_right = True
+
+    def __init__(self, low, high):
+        assert low <= high, f"Empty range: {low} > {high}"
+        self.low = low
+        self.high = high
+
+    def __contains__(self, value) -> bool:
+        return self.low <= value <= self.high if self.closed_right else self.low <= value < self.high
+
+    def mask(self, values):
+        "Vectorized membership over a numpy array."
+        upper = values <= self.high if self.closed_right else values < self.high
+        return (values >= self.low) & upper
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and (self.low, self.high) == (other.low, other.high)
+
+    def __hash__(self) -> int:
+        return hash((type(self), self.low, self.high))
+
+    def __repr__(self) -> str:
+        return f"[{self.low}, {self.high}{']' if self.closed_right else ')'}"
+
+class Interval(Range):
+    "A half-open band `[low, high)`; adjacent intervals partition a value without overlap or gaps."
+    __slots__ = ()
+    closed_right = False
+
+class ValueSet:
+    "A hashed set of allowed values, checked in constant time."
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = frozenset(values)
+
+    def __contains__(self, value) -> bool:
+        return value in self.values
+
+    def mask(self, values):
+        "Vectorized membership over a numpy array."
+        import numpy as np
+        if values.dtype == object: return np.fromiter((value in self.values for value in values), bool, len(values))
+        return np.isin(values, list(self.values))
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.values == other.values
+
+    def __hash__(self) -> int:
+        return hash(self.values)
+
+    def __repr__(self) -> str:
+        return "{" + ", ".join(map(repr, sorted(self.values, key=repr))) + "}"
+
+PREDICATE_OPERATIONS = {
+    "between": Range,
+    "in_interval": Interval,
+    "in_set": ValueSet,
+}
+
+def as_predicate(operation : str, threshold):
+    "Coerce `threshold` for one of the `PREDICATE_OPERATIONS`, e.g. `(5.1, 5.5)` to `Range(5.1, 5.5)`."
+    predicate_type = PREDICATE_OPERATIONS[operation]
+    if isinstance(threshold, predicate_type): return threshold
+    return predicate_type(threshold) if predicate_type is ValueSet else predicate_type(*threshold)
+
+def within(value, predicate) -> bool:
+    return value in predicate
+
+# %% ../basics.ipynb 5
+# An amount or range of amounts and an optional unit of letters only, so that e.g. "24/26 mg" does not parse
+_DOSE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:-\s*(\d+(?:\.\d+)?))?\s*([^\W\d_]+)?\s*$")
+
+# Mass units are converted to mg; amounts are kept as integer thousandths of the (converted) unit.
+_UNIT_SCALES = {'mg': ('mg', 1), 'g': ('mg', 1000), 'mcg': ('mg', 0.001), 'ug': ('mg', 0.001), 'µg': ('mg', 0.001)}
+
+DOSES_PER_DAY = {
+    'daily': 1, 'qd': 1, 'once daily': 1, 'qam': 1, 'qhs': 1, 'q24h': 1,
+    'bid': 2, 'twice daily': 2, 'q12h': 2,
+    'tid': 3, 'q8h': 3,
+    'qid': 4, 'q6h': 4,
+    'weekly': 1 / 7,
+}
+
+@total_ordering
+class Dose:
+    """
+    A parsed dose: an amount, or a range of amounts such as the "24-26 mg" of a combination product,
+    with its unit, route and frequency. `key` is a hashable canonical form ("12.5 mg" and "12.50mg"
+    have the same key), and `daily_amount` is the total daily dose in `unit`, taking a range at its
+    upper bound. Doses that cannot be parsed keep their text as their key and have no daily amount.
+    Doses are ordered by `(unit, low, high)`, then route and frequency; unparsed doses sort last.
+    """
+    __slots__ = ('low', 'high', 'unit', 'route', 'frequency', 'amount_key', 'key', 'daily_amount')
+
+    def __init__(self, dose : str, route : Optional[str] = "", frequency : Optional[str] = "") -> None:
+        self.route = (route or "").strip().upper()
+        self.frequency = (frequency or "").strip().lower()
+        self.low, self.high, self.unit = _parse_amount(dose)
+        self.amount_key = (self.low, self.high, self.unit) if self.low is not None else (dose.strip().lower(),)
+        self.key = self.amount_key + (self.route, self.frequency)
+        per_day = DOSES_PER_DAY.get(self.frequency)
+        self.daily_amount = self.high / 1000 * per_day if self.high is not None and per_day is not None else None
+
+    @property
+    def is_range(self) -> bool:
+        return self.low != self.high
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Dose) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    @property
+    def _order_key(self) -> tuple:
+        if self.low is None: return (True,) + self.key
+        return (False, self.unit, self.low, self.high, self.route, self.frequency)
+
+    def __lt__(self, other) -> bool:
+        if not isinstance(other, Dose): return NotImplemented
+        return self._order_key < other._order_key
+
+    def __repr__(self) -> str:
+        if self.low is None: return f"Dose({self.amount_key[0]!r}, {self.route!r}, {self.frequency!r})"
+        amount = f"{self.low / 1000:g}" if not self.is_range else f"{self.low / 1000:g}-{self.high / 1000:g}"
+        return f"Dose({amount} {self.unit}, {self.route!r}, {self.frequency!r})"
+
+@lru_cache(maxsize=4096)
+def _parse_amount(dose : str) -> tuple:
+    "Parse e.g. '24-26 mg' to `(low, high, unit)`, amounts in integer thousandths of the canonical unit; `(None, None, None)` if unparsable."
+    match = _DOSE_PATTERN.match(dose)
+    if match is None: return None, None, None
+    low, high, unit = match.groups()
+    unit, scale = _UNIT_SCALES.get((unit or "").lower(), ((unit or "").lower(), 1))
+    low = round(float(low) * scale * 1000)
+    high = round(float(high) * scale * 1000) if high is not None else low
+    return low, high, unit
+
+def dose_amount_key(dose : str) -> tuple:
+    "The `Dose.amount_key` of a dose string, e.g. to look up a ladder step by its dose."
+    low, high, unit = _parse_amount(dose)
+    return (low, high, unit) if low is not None else (dose.strip().lower(),)
+
+# %% ../basics.ipynb 8
 class MedicationClass:
     """A medication class"""
+    __slots__ = ('name',)
+
     def __init__(self, name:str):
         self.name = name
 
 class Ingredient:
+    __slots__ = ('name', 'med_class')
+
     def __init__(self, name:str, med_class : Optional[MedicationClass] = None):  # TODO: modify to make med_class required
         self.name = name
         self.med_class = med_class
 
 class Medication:
+    __slots__ = ('ingredient', 'dose', 'route', 'frequency', 'parsed_dose', 'key')
+
     def __init__(self, ingredient:Ingredient, dose:str, route:str, frequency:str):
         self.ingredient = ingredient
         self.dose = dose
         self.route = route
         self.frequency = frequency
+        # Parsed once; a medication's dose, route and frequency are not expected to change
+        self.parsed_dose = Dose(dose, route, frequency)
+        self.key = (ingredient.name,) + self.parsed_dose.key
 
     @property
     def name(self):
         return self.ingredient.name
+
+    @property
+    def daily_dose(self) -> Optional[float]:
+        return self.parsed_dose.daily_amount
     
     @property
     def med_class(self):
         return self.ingredient.med_class
 
+    @property
+    def sort_key(self) -> tuple:
+        "Orders medications by their parsed doses (see `Dose`), then by ingredient name, e.g. `sorted(meds, key=lambda med: med.sort_key)`."
+        return (self.parsed_dose, self.name)
+
     def __repr__(self) -> str:
         return f"{self.name} {self.dose} {self.route} {self.frequency}"
 
-# %% ../basics.ipynb 4
+# %% ../basics.ipynb 10
 class Reaction:
     """
     A listing of an adverse medication reaction or allergy.
     """
+    __slots__ = ('ingredient', 'description')
+
     def __init__(self, ingredient: Ingredient, description: str):
         self.ingredient = ingredient
         self.description = description
 
-# %% ../basics.ipynb 5
+# %% ../basics.ipynb 11
 class Patient:
+    __slots__ = ('medications', 'reactions', 'max_tolerated', *VALID_PARAMETERS)
+
     def __init__(self, 
                  medications : List[Medication] = [],
                  reactions : List[Reaction] = [],
@@ -87,3 +267,188 @@ class Patient:
     def has_reaction_to(self, ingredient : Ingredient):
         meds_w_reactions = [reaction.ingredient.name for reaction in self.reactions]
         return ingredient.name in meds_w_reactions
+
+# %% ../basics.ipynb 13
+class MedicationInterner:
+    """
+    Maps (ingredient name, dose, route, frequency) to a single canonical `Medication`, so that patients
+    loaded from records share medication objects (typically the steps of the dosing ladders) instead
+    of each holding their own copies.
+    """
+    def __init__(self, medications : List[Medication] = []) -> None:
+        self._medications = {}
+        self._ingredients = {}
+        for med in medications: self.add(med)
+
+    @staticmethod
+    def _key(med : Medication) -> tuple:
+        return med.key
+
+    def __len__(self) -> int:
+        return len(self._medications)
+
+    def add(self, med : Medication) -> Medication:
+        "Make `med` canonical for its key, unless there already is a canonical medication; returns the canonical one."
+        self._ingredients.setdefault(med.name, med.ingredient)
+        return self._medications.setdefault(self._key(med), med)
+
+    def ingredient(self, name : str) -> Ingredient:
+        "The ingredient of the canonical medications named `name` (a new one, if there are none)."
+        return self._ingredients.setdefault(name, Ingredient(name))
+
+    def intern(self, ingredient : Ingredient | str, dose : str, route : str, frequency : str) -> Medication:
+        name = ingredient if isinstance(ingredient, str) else ingredient.name
+        med = self._medications.get((name,) + Dose(dose, route, frequency).key)
+        if med is None:
+            if isinstance(ingredient, str): ingredient = self.ingredient(name)
+            med = self.add(Medication(ingredient, dose, route, frequency))
+        return med
+
+    def intern_patient(self, patient : "Patient") -> "Patient":
+        "Replace the patient's medications and max tolerated doses with their canonical instances."
+        patient.medications = [self.add(med) for med in patient.medications]
+        if patient.max_tolerated:
+            patient.max_tolerated = {name: self.add(med) for name, med in patient.max_tolerated.items()}
+        return patient
+
+# %% ../basics.ipynb 15
+class _ObservedList(list):
+    "A list that reports items added to and removed from it, so that indexes over it can be kept up to date."
+    def __init__(self, items, on_add, on_remove):
+        super().__init__(items)
+        self._on_add = on_add
+        self._on_remove = on_remove
+
+    def append(self, item):
+        super().append(item)
+        self._on_add(item)
+
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        for item in items: self._on_add(item)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._on_add(item)
+
+    def remove(self, item):
+        super().remove(item)
+        self._on_remove(item)
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        self._on_remove(item)
+        return item
+
+    def clear(self):
+        items = list(self)
+        super().clear()
+        for item in items: self._on_remove(item)
+
+    def __setitem__(self, index, value):
+        removed = self[index] if isinstance(index, slice) else [self[index]]
+        added = list(value) if isinstance(index, slice) else [value]
+        super().__setitem__(index, added if isinstance(index, slice) else value)
+        for item in removed: self._on_remove(item)
+        for item in added: self._on_add(item)
+
+    def __delitem__(self, index):
+        removed = self[index] if isinstance(index, slice) else [self[index]]
+        super().__delitem__(index)
+        for item in removed: self._on_remove(item)
+
+    def __reduce__(self):
+        # The callbacks belong to the owner, so a copy is a plain list
+        return list, (list(self),)
+
+class IndexedPatient(Patient):
+    """
+    A `Patient` that maintains lookup tables over its medications and reactions, so that the
+    medication and reaction queries do not scan the full lists. The tables are updated
+    incrementally when `medications` or `reactions` are modified in place (e.g. by
+    `ReportReaction.perform`) or reassigned.
+    """
+    @property
+    def medications(self) -> List[Medication]:
+        return self._medications
+
+    @medications.setter
+    def medications(self, medications : List[Medication]):
+        self._meds_by_name = {}
+        self._meds_by_class_name = {}
+        self._medications = _ObservedList([], self._add_medication, self._remove_medication)
+        self._medications.extend(medications)
+
+    @property
+    def reactions(self) -> List[Reaction]:
+        return self._reactions
+
+    @reactions.setter
+    def reactions(self, reactions : List[Reaction]):
+        self._reaction_counts = {}
+        self._reactions = _ObservedList([], self._add_reaction, self._remove_reaction)
+        self._reactions.extend(reactions)
+
+    def __getstate__(self) -> dict:
+        # Pickled (and deep-copied) with plain lists; `__setstate__` rebuilds the lookup tables
+        state = {name: getattr(self, name) for name in ('max_tolerated', *VALID_PARAMETERS) if hasattr(self, name)}
+        state.update(medications=list(self._medications), reactions=list(self._reactions))
+        return state
+
+    def __setstate__(self, state : dict):
+        for name, value in state.items(): setattr(self, name, value)
+
+    @staticmethod
+    def _add_to(index : dict, key, item):
+        index.setdefault(key, []).append(item)
+
+    @staticmethod
+    def _remove_from(index : dict, key, item):
+        items = index[key]
+        items.remove(item)
+        if not items: del index[key]
+
+    def _add_medication(self, med : Medication):
+        self._add_to(self._meds_by_name, med.name, med)
+        if med.med_class: self._add_to(self._meds_by_class_name, med.med_class.name, med)
+
+    def _remove_medication(self, med : Medication):
+        self._remove_from(self._meds_by_name, med.name, med)
+        if med.med_class: self._remove_from(self._meds_by_class_name, med.med_class.name, med)
+
+    def _add_reaction(self, reaction : Reaction):
+        name = reaction.ingredient.name
+        self._reaction_counts[name] = self._reaction_counts.get(name, 0) + 1
+
+    def _remove_reaction(self, reaction : Reaction):
+        name = reaction.ingredient.name
+        self._reaction_counts[name] -= 1
+        if not self._reaction_counts[name]: del self._reaction_counts[name]
+
+    def on_medication(self, ingredient : Ingredient, dose : str = None):
+        return ingredient.name in self._meds_by_name
+
+    @property
+    def current_medication_names(self):
+        # A view rather than a list: membership tests are constant-time and each name appears once.
+        return self._meds_by_name.keys()
+    
+    @property
+    def current_med_class_names(self):
+        return self._meds_by_class_name.keys()
+
+    def medications_of_class(self, med_class : MedicationClass) -> List[Medication]:
+        return list(self._meds_by_class_name.get(med_class.name, []))
+
+    def current_dose_of(self, ingredient : Ingredient):
+        filtered = self._meds_by_name.get(ingredient.name, [])
+        assert len(filtered) <= 1
+        return filtered[0] if filtered else None
+
+    def has_reaction_to(self, ingredient : Ingredient):
+        return ingredient.name in self._reaction_counts
@@ -0,0 +1,186 @@
+"""
+Benchmarks for rule, ladder and titrator evaluation over synthetic cohorts.
+
+    python -m titrations.benchmarks --sizes 1,1000,1000000 --output results.json
+
+Each benchmark is timed on its own and then re-run under `tracemalloc` to record peak memory.
+Cohorts cycle through a fixed pool of distinct synthetic patients, so that large sizes measure
+evaluation rather than patient construction. The report also records how much memory interning
+medications saves at each size.
+"""
+
+__all__ = ['DEFAULT_SIZES', 'synthetic_patients', 'BENCHMARKS', 'run_benchmark', 'measure_interning', 'run_benchmarks']
+
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from itertools import cycle, islice
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .basics import *
+from .titrations2 import columns_from_patients
+from . import titrations as legacy
+from . import examples
+
+DEFAULT_SIZES = [1, 100, 10_000, 1_000_000]
+POOL_SIZE = 10_000
+
+def _random_patient(rng : random.Random) -> Patient:
+    ladder = rng.choice([examples.beta_blocker_ladder, examples.raasi_ladder, examples.sglt2i_ladder, examples.mra_ladder])
+    subladder = rng.choice(list(ladder.ladder.values()))
+    medications = [rng.choice(subladder)] if rng.random() < 0.7 else []
+    max_tolerated = {med.name: med for med in medications if rng.random() < 0.2}
+    return Patient(
+        medications=medications, max_tolerated=max_tolerated,
+        SBP=rng.gauss(115, 15), HR=rng.gauss(72, 10), K=rng.gauss(4.5, 0.5), Cr=rng.gauss(1.1, 0.3), eGFR=rng.gauss(60, 20),
+        decompensated=rng.random() < 0.05, symptomatic=rng.random() < 0.1, has_pacemaker=rng.random() < 0.1,
+        av_block=rng.random() < 0.02, severe_gu_infxns=rng.random() < 0.01, has_type_1_diabetes=rng.random() < 0.01,
+        has_type_2_diabetes_on_insulin=rng.random() < 0.05,
+    )
+
+def synthetic_patients(size : int, seed : int = 0) -> List[Patient]:
+    "A cohort of `size` patients cycling through at most `POOL_SIZE` distinct synthetic patients."
+    rng = random.Random(seed)
+    pool = [_random_patient(rng) for _ in range(min(size, POOL_SIZE))]
+    return list(islice(cycle(pool), size))
+
+def _legacy_patients(patients : List[Patient]) -> List[Patient]:
+    # The legacy titrators only know metoprolol; keep patients below the top step so `StepUp` can suggest.
+    steps = legacy.metoprolol_ladder.steps[:-1]
+    pool = {}
+    for patient in patients:
+        if id(patient) not in pool:
+            parameters = {p: getattr(patient, p) for p in VALID_PARAMETERS if hasattr(patient, p)}
+            pool[id(patient)] = Patient(medications=[steps[len(pool) % len(steps)]], reactions=[], **parameters)
+    return [pool[id(patient)] for patient in patients]
+
+def _each(function : Callable) -> Callable:
+    def run(items):
+        for item in items: function(item)
+    return run
+
+def _titrator(titrator_class : type, compiled : bool = False) -> Callable:
+    def evaluate(patient):
+        titrator_class(patient).evaluate(compiled=compiled)
+    return evaluate
+
+def _ladder_steps(patients : List[Patient]) -> List[Medication]:
+    ladder = examples.beta_blocker_ladder
+    steps = [med for subladder in ladder.ladder.values() for med in subladder[:-1]]
+    return list(islice(cycle(steps), len(patients)))
+
+def _columns(patients : List[Patient]) -> Dict[str, np.ndarray]:
+    # Building masked columns row by row is slow; tile the columns of the distinct patients instead.
+    pool = patients[:POOL_SIZE]
+    columns = columns_from_patients(pool)
+    return {name: np.ma.resize(column, len(patients)) for name, column in columns.items()}
+
+# name -> (prepare the inputs from the cohort, run over the inputs)
+BENCHMARKS : Dict[str, tuple] = {
+    'Rule.evaluate': (None, _each(examples.hypotension.evaluate)),
+    'ConditionalRule.evaluate': (None, _each(examples.bradycardia.evaluate)),
+    'Rule.evaluate_batch': (_columns, examples.hypotension.evaluate_batch),
+    'ConditionalRule.evaluate_batch': (_columns, examples.bradycardia.evaluate_batch),
+    'DosingLadder.get_current_medication_for_patient': (None, _each(examples.beta_blocker_ladder.get_current_medication_for_patient)),
+    'DosingLadder.get_next_step_up': (_ladder_steps, _each(examples.beta_blocker_ladder.get_next_step_up)),
+    'DosingLadder.get_next_step_down': (lambda patients: [examples.beta_blocker_ladder.get_next_step_up(med) for med in _ladder_steps(patients)],
+                                        _each(examples.beta_blocker_ladder.get_next_step_down)),
+    **{f'{titrator_class.__name__}.evaluate': (None, _each(_titrator(titrator_class)))
+       for titrator_class in [examples.BetaBlockerTitrator, examples.RAASiTitrator, examples.SGLT2iTitrator, examples.MRATitrator]},
+    **{f'{titrator_class.__name__}.evaluate(compiled=True)': (None, _each(_titrator(titrator_class, compiled=True)))
+       for titrator_class in [examples.BetaBlockerTitrator, examples.RAASiTitrator, examples.SGLT2iTitrator, examples.MRATitrator]},
+    'titrations.Titrator.get_suggestion_texts': (_legacy_patients,
+                                                 _each(lambda patient: legacy.MetoprololTitrator(patient).get_suggestion_texts())),
+}
+
+def run_benchmark(name : str, patients : List[Patient]) -> Dict[str, Any]:
+    prepare, run = BENCHMARKS[name]
+    inputs = prepare(patients) if prepare else patients
+
+    gc.collect()
+    start = time.perf_counter()
+    run(inputs)
+    seconds = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    run(inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'benchmark': name,
+        'size': len(patients),
+        'seconds': seconds,
+        'microseconds_per_patient': seconds / len(patients) * 1e6,
+        'peak_memory_bytes': peak,
+    }
+
+def _copied_medication(med : Medication) -> Medication:
+    # What loading a record without interning produces: fresh objects all the way down
+    ingredient = Ingredient(med.name, MedicationClass(med.med_class.name))
+    return Medication(ingredient, med.dose, med.route, med.frequency)
+
+def measure_interning(size : int, seed : int = 0) -> Dict[str, Any]:
+    "Memory held by a cohort's medication objects when each patient record copies them versus when they are interned."
+    patients = synthetic_patients(size, seed)
+    interner = MedicationInterner([med for ladder in [examples.beta_blocker_ladder, examples.raasi_ladder,
+                                                      examples.sglt2i_ladder, examples.mra_ladder]
+                                   for subladder in ladder.ladder.values() for med in subladder])
+    sizes = {}
+    for mode, load in [('copied', _copied_medication),
+                       ('interned', lambda med: interner.intern(med.name, med.dose, med.route, med.frequency))]:
+        gc.collect()
+        tracemalloc.start()
+        medications = [[load(med) for med in patient.medications] for patient in patients]
+        sizes[mode] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del medications
+    return {
+        'size': size,
+        'copied_bytes': sizes['copied'],
+        'interned_bytes': sizes['interned'],
+        'saved_bytes': sizes['copied'] - sizes['interned'],
+        'saved_fraction': 1 - sizes['interned'] / sizes['copied'] if sizes['copied'] else 0.0,
+    }
+
+def run_benchmarks(sizes : List[int] = DEFAULT_SIZES, names : Optional[List[str]] = None, seed : int = 0) -> Dict[str, Any]:
+    "Run the selected benchmarks (all by default) at each cohort size; returns a JSON-serializable report."
+    names = names or list(BENCHMARKS)
+    results = []
+    for size in sizes:
+        patients = synthetic_patients(size, seed)
+        for name in names:
+            results.append(run_benchmark(name, patients))
+            print(f"{name} [{size}]: {results[-1]['seconds']:.4f}s", file=sys.stderr)
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': results,
+        'interning': [measure_interning(size, seed) for size in sizes],
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark rule, ladder and titrator evaluation.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma-separated cohort sizes")
+    parser.add_argument("--benchmarks", default=None, help="comma-separated benchmark names (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmarks([int(size) for size in args.sizes.split(",")],
+                            args.benchmarks.split(",") if args.benchmarks else None, args.seed)
+    if args.output:
+        with open(args.output, "w") as f: json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,164 @@
+__all__ = ['TitratorCache']
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .basics import *
+from .titrations2 import *
+
+# Patient attributes that are covered by the current ladder step rather than read directly
+_MEDICATION_STATE = frozenset(['medications', 'max_tolerated'])
+
+# Comparisons whose outcome only depends on where the value falls relative to the threshold
+_ORDERED_OPERATIONS = frozenset(['gt', 'gte', 'lt', 'lte', 'eq', 'neq'])
+
+def _all_rules(rules : List[Rule]) -> List[Rule]:
+    "`rules` with their conditions and nested rules, depth first."
+    found = []
+    for rule in rules:
+        found.append(rule)
+        nested = [action for action in getattr(rule, 'actions_when_satisfied', []) + getattr(rule, 'actions_when_not_satisfied', [])
+                  if isinstance(action, Rule)]
+        if isinstance(rule, ConditionalRule): nested.insert(0, rule.condition)
+        found += _all_rules(nested)
+    return found
+
+def _cut_points(rules : List[Rule]) -> Dict[str, Optional[Tuple]]:
+    """
+    For each parameter the rules read, the sorted thresholds the rules compare it against, or `None`
+    if some rule reads it in a way that cannot be reduced to comparisons (e.g. `in`, or a rule type
+    with its own `_is_satisfied`), in which case the value itself must be part of the key.
+    """
+    cut_points = {}
+    for rule in rules:
+        if type(rule)._is_satisfied not in (Rule._is_satisfied, ConditionalRule._is_satisfied):
+            for parameter in rule.parameters - _MEDICATION_STATE: cut_points[parameter] = None
+            continue
+        thresholds = cut_points.setdefault(rule.parameter, set())
+        if thresholds is None: continue
+        if isinstance(rule.threshold, Range): thresholds.update([rule.threshold.low, rule.threshold.high])
+        elif rule.operation in _ORDERED_OPERATIONS and type(rule.threshold) in (int, float, bool): thresholds.add(rule.threshold)
+        else: cut_points[rule.parameter] = None
+    return {parameter: None if thresholds is None else tuple(sorted(thresholds)) for parameter, thresholds in cut_points.items()}
+
+def _target(titrator : Titrator) -> Any:
+    """
+    What identifies `titrator`'s titration target in a key: the `MaxTolerated` built for the titrator's
+    own ladder and step only reads the medication state already in the key, so its type stands for it;
+    any other target is itself part of the key.
+    """
+    target = titrator.titration_target
+    if type(target) is MaxTolerated and target.dosing_ladder is titrator.dosing_ladder \
+       and target.current_medication is titrator.current_medication:
+        return MaxTolerated
+    return target
+
+def _bucket(value : Any, cut_points : Optional[Tuple]) -> Hashable:
+    "Where `value` falls among `cut_points` (below, at or above each), or the value itself if there are none."
+    if value is None or cut_points is None: return value
+    try: return bisect_left(cut_points, value), bisect_right(cut_points, value)
+    except TypeError: return (value,)  # not comparable to the thresholds; one-tuples cannot collide with the pairs
+
+class TitratorCache:
+    """
+    A bounded LRU memo of `Titrator.evaluate` outcomes. Entries are keyed on the titrator class and
+    titration target, the patient's current ladder step and max tolerated dose, and, for each patient
+    parameter the titrator's rules (including the target) read, where its value falls relative to the
+    thresholds the rules compare it against (e.g. SBP below 100, HR at or above 60), so patients whose
+    rules all come out the same share an entry. Entries are dropped when the titrator's
+    `default_rules`, their or the target's thresholds (including edits in place) or its dosing ladder
+    change.
+    """
+    maxsize : int
+    hits : int
+    misses : int
+    evictions : int
+    invalidations : int
+
+    def __init__(self, maxsize : int = 65536) -> None:
+        assert maxsize > 0, "Cache size must be positive."
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._signatures = {}
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _signature(self, titrator : Titrator, rules : List[Rule]) -> Tuple:
+        ladder = titrator.dosing_ladder
+        thresholds = tuple((rule.operation, rule.threshold) if hasattr(rule, 'threshold') else None for rule in rules)
+        return (tuple(titrator.default_rules), thresholds, id(ladder), ladder.version)
+
+    def _cut_points(self, titrator : Titrator) -> Tuple[Tuple[str, Optional[Tuple]], ...]:
+        scope = (type(titrator), _target(titrator))
+        known = self._signatures.get(scope)
+        # `known` holds the signature, all the rules (with conditions and nested rules) and the cut points
+        if known is None or known[0] != self._signature(titrator, known[1]):
+            if known is not None: self._invalidate(scope)
+            rules = _all_rules(titrator.default_rules + [titrator.titration_target])
+            parameters = frozenset().union(*[rule.parameters for rule in rules]) - _MEDICATION_STATE
+            cut_points = _cut_points(rules)
+            known = (self._signature(titrator, rules), rules,
+                     tuple((parameter, cut_points.get(parameter)) for parameter in sorted(parameters)))
+            self._signatures[scope] = known
+        return known[2]
+
+    def _invalidate(self, scope : Tuple[type[Titrator], Any]) -> None:
+        stale = [key for key in self._entries if key[:2] == scope]
+        for key in stale: del self._entries[key]
+        self.invalidations += 1
+
+    def key(self, titrator : Titrator) -> Optional[Hashable]:
+        "The fingerprint for `titrator`'s patient, or `None` if the patient's state is not hashable."
+        patient, current_medication = titrator.patient, titrator.current_medication
+        step = max_tolerated = None
+        if current_medication:
+            step = current_medication.key
+            max_tolerated = patient.max_tolerated.get(current_medication.name) if patient.max_tolerated else None
+            max_tolerated = max_tolerated.key if max_tolerated is not None else None
+        key = (type(titrator), _target(titrator), step, max_tolerated,
+               tuple(_bucket(getattr(patient, parameter, None), cut_points) for parameter, cut_points in self._cut_points(titrator)))
+        try: hash(key)
+        except TypeError: return None
+        return key
+
+    def evaluate(self, titrator : Titrator, compiled : bool = False) -> None:
+        "Equivalent to `titrator.evaluate(compiled)`, reusing a stored outcome when there is one."
+        key = self.key(titrator)
+        entry = self._entries.get(key) if key is not None else None
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            satisfied_rules, target_satisfied, action_classes = entry
+            titrator.recommend(list(satisfied_rules) + ([titrator.titration_target] if target_satisfied else []), action_classes)
+            return
+
+        self.misses += 1
+        titrator.evaluate(compiled=compiled)
+        if key is None: return
+        self._entries[key] = (
+            tuple(rule for rule in titrator.satisfied_rules if rule is not titrator.titration_target),
+            titrator.titration_target in titrator.satisfied_rules,
+            tuple(type(action) for action in titrator.recommended_actions) if not titrator.can_advance else (),
+        )
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._signatures.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,259 @@
+"""
+A declarative catalog of medication classes, ingredients, dosing ladders, rules and titrators.
+
+Catalogs are written as JSON (`examples.json` is the catalog equivalent to `examples.py`) and can be
+compiled to a binary form whose entries are decoded only when used. Either way, objects are built on
+first use, so that loading cost does not grow with the parts of the catalog that go unused.
+
+Titrator classes built from a catalog pickle as a reference to their catalog entry (the catalog's
+path, or its specification if it was not loaded from a file), so they can be sent to worker processes.
+"""
+
+__all__ = ['RULE_TYPES', 'ACTION_TYPES', 'SECTIONS', 'Catalog', 'compile_catalog', 'load_catalog']
+
+import copyreg
+import json
+import struct
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping
+
+from .basics import *
+from .titrations2 import *
+
+RULE_TYPES = {rule_type.__name__: rule_type for rule_type in [
+    Rule, ConditionalRule, RuleWithActions, ConditionalRuleWithActions,
+    ClassLimitingRule, TitrationLimitingRule, NonLimitingRule, ConditionTitrationLimitingRule,
+]}
+ACTION_TYPES = {action_type.__name__: action_type for action_type in [
+    Start, DoNotStart, StepUp, StepDown, Continue, Stop, MarkMaxDose, ReportReaction,
+]}
+SECTIONS = ['classes', 'ingredients', 'ladders', 'rules', 'titrators']
+
+_MAGIC = b"TITRCAT2"
+_HEADER = struct.Struct("<Q")
+
+class _BinarySection(Mapping):
+    "A catalog section whose entries are decoded from the compiled catalog (one JSON document each) only when accessed."
+    def __init__(self, data : memoryview, offsets : Dict[str, tuple]) -> None:
+        self._data = data
+        self._offsets = offsets
+        self._decoded = {}
+
+    def __getitem__(self, name : str) -> Any:
+        if name not in self._decoded:
+            start, length = self._offsets[name]
+            self._decoded[name] = json.loads(bytes(self._data[start:start + length]))
+        return self._decoded[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+class Catalog:
+    """
+    Builds `MedicationClass`, `Ingredient`, `DosingLadder`, rule and `Titrator` objects from a catalog
+    specification, each at most once and only when first requested.
+
+    A specification has five sections, each mapping names to entries:
+    - `classes`: `{}` (medication classes carry no data beyond their name)
+    - `ingredients`: `{"class": <class name>}`
+    - `ladders`: `{<ingredient name>: [{"dose", "route", "frequency"}, ...]}`
+    - `rules`: `{"type": <RULE_TYPES key>, "parameter", "operation", "threshold"}`, plus a `condition`
+      (rule name) for conditional rules and `additional_actions_when_satisfied`/`..._not_satisfied`
+      (action or rule names) for rules with actions
+    - `titrators`: `{"ladder": <ladder name>, "rules": [<rule name>, ...]}`, optionally with a `class_name`
+    """
+    def __init__(self, spec : Dict[str, Mapping[str, Any]], validate : bool = True) -> None:
+        self.spec = {section: spec.get(section, {}) for section in SECTIONS}
+        if validate: self.validate()
+        self._built = {section: {} for section in SECTIONS}
+        self.path = None  # set when loaded from a file, so that its titrators pickle by reference
+
+    @classmethod
+    def from_json(cls, path : str | Path) -> 'Catalog':
+        with open(path) as f: catalog = cls(json.load(f))
+        catalog.path = Path(path)
+        return catalog
+
+    @classmethod
+    def from_binary(cls, path : str | Path) -> 'Catalog':
+        "Load a catalog written by `to_binary`; it was validated before it was compiled."
+        data = memoryview(Path(path).read_bytes())
+        if bytes(data[:len(_MAGIC)]) != _MAGIC: raise ValueError(f"{path} is not a compiled catalog.")
+        (toc_length,) = _HEADER.unpack_from(data, len(_MAGIC))
+        toc_start = len(_MAGIC) + _HEADER.size
+        toc = json.loads(bytes(data[toc_start:toc_start + toc_length]))
+        entries = data[toc_start + toc_length:]
+        catalog = cls({section: _BinarySection(entries, offsets) for section, offsets in toc.items()}, validate=False)
+        catalog.path = Path(path)
+        return catalog
+
+    def to_binary(self, path : str | Path) -> None:
+        blobs, toc, offset = [], {}, 0
+        for section in SECTIONS:
+            toc[section] = {}
+            for name in self.spec[section]:
+                blob = json.dumps(self.spec[section][name], separators=(',', ':')).encode()
+                toc[section][name] = (offset, len(blob))
+                blobs.append(blob)
+                offset += len(blob)
+        toc_blob = json.dumps(toc, separators=(',', ':')).encode()
+        with open(path, "wb") as f:
+            f.write(_MAGIC + _HEADER.pack(len(toc_blob)) + toc_blob)
+            for blob in blobs: f.write(blob)
+
+    # Validation
+
+    def validate(self) -> None:
+        "Check that every entry is well-formed and that every reference resolves; raises `ValueError`."
+        errors = []
+        def check(condition, message):
+            if not condition: errors.append(message)
+
+        for name, ingredient in self.spec['ingredients'].items():
+            check(ingredient.get('class') in self.spec['classes'], f"Ingredient `{name}` has unknown class {ingredient.get('class')!r}.")
+        for name, ladder in self.spec['ladders'].items():
+            check(len(ladder) > 0, f"Ladder `{name}` is empty.")
+            for ingredient, steps in ladder.items():
+                check(ingredient in self.spec['ingredients'], f"Ladder `{name}` uses unknown ingredient `{ingredient}`.")
+                check(len(steps) > 0, f"Ladder `{name}` has no steps for `{ingredient}`.")
+                for step in steps:
+                    check(all(isinstance(step.get(key), str) for key in ('dose', 'route', 'frequency')),
+                          f"Ladder `{name}` has a step for `{ingredient}` without a dose, route and frequency.")
+                doses = [step.get('dose') for step in steps]
+                check(len(set(doses)) == len(doses), f"Ladder `{name}` repeats a dose for `{ingredient}`.")
+        for name, rule in self.spec['rules'].items():
+            rule_type = RULE_TYPES.get(rule.get('type'))
+            check(rule_type is not None, f"Rule `{name}` has unknown type {rule.get('type')!r}.")
+            if rule_type is None: continue
+            check(rule.get('parameter') in VALID_PARAMETERS or hasattr(Patient, rule.get('parameter', '')),
+                  f"Rule `{name}` has unknown parameter {rule.get('parameter')!r}.")
+            check(rule.get('operation') in Rule.operators, f"Rule `{name}` has unknown operation {rule.get('operation')!r}.")
+            check('threshold' in rule, f"Rule `{name}` has no threshold.")
+            if issubclass(rule_type, ConditionalRule):
+                check(rule.get('condition') in self.spec['rules'], f"Rule `{name}` has unknown condition {rule.get('condition')!r}.")
+            for key in ('additional_actions_when_satisfied', 'additional_actions_when_not_satisfied'):
+                check(key not in rule or issubclass(rule_type, RuleWithActions), f"Rule `{name}` cannot have `{key}`.")
+                for action in rule.get(key, []):
+                    check(action in ACTION_TYPES or action in self.spec['rules'], f"Rule `{name}` has unknown action {action!r}.")
+        for name in self.spec['rules']:
+            check(not self._has_cycle(name, set()), f"Rule `{name}` refers back to itself.")
+        for name, titrator in self.spec['titrators'].items():
+            check(titrator.get('ladder') in self.spec['ladders'], f"Titrator `{name}` has unknown ladder {titrator.get('ladder')!r}.")
+            for rule in titrator.get('rules', []):
+                check(rule in self.spec['rules'], f"Titrator `{name}` has unknown rule {rule!r}.")
+
+        if errors: raise ValueError("Invalid catalog:\n" + "\n".join(errors))
+
+    def _references(self, name : str) -> List[str]:
+        rule = self.spec['rules'].get(name, {})
+        references = [rule['condition']] if 'condition' in rule else []
+        references += [action for key in ('additional_actions_when_satisfied', 'additional_actions_when_not_satisfied')
+                       for action in rule.get(key, []) if action in self.spec['rules']]
+        return references
+
+    def _has_cycle(self, name : str, visiting : set) -> bool:
+        if name in visiting: return True
+        visiting = visiting | {name}
+        return any(self._has_cycle(reference, visiting) for reference in self._references(name))
+
+    # Building
+
+    def _get(self, section : str, name : str, build) -> Any:
+        built = self._built[section]
+        if name not in built:
+            if name not in self.spec[section]: raise KeyError(f"No {section[:-1]} named `{name}` in the catalog.")
+            built[name] = build(name, self.spec[section][name])
+        return built[name]
+
+    def med_class(self, name : str) -> MedicationClass:
+        return self._get('classes', name, lambda name, entry: MedicationClass(name))
+
+    def ingredient(self, name : str) -> Ingredient:
+        return self._get('ingredients', name, lambda name, entry: Ingredient(name, self.med_class(entry['class'])))
+
+    def ladder(self, name : str) -> DosingLadder:
+        def build(name, entry):
+            return DosingLadder({
+                ingredient_name: [Medication(self.ingredient(ingredient_name), step['dose'], step['route'], step['frequency'])
+                                  for step in steps]
+                for ingredient_name, steps in entry.items()
+            })
+        return self._get('ladders', name, build)
+
+    def rule(self, name : str) -> Rule:
+        def action(name):
+            return ACTION_TYPES[name] if name in ACTION_TYPES else self.rule(name)
+
+        def build(name, entry):
+            rule_type = RULE_TYPES[entry['type']]
+            kwargs = {}
+            if issubclass(rule_type, ConditionalRule): kwargs['condition'] = self.rule(entry['condition'])
+            for key in ('additional_actions_when_satisfied', 'additional_actions_when_not_satisfied'):
+                if key in entry: kwargs[key] = [action(name) for name in entry[key]]
+            return rule_type(entry['parameter'], entry['operation'], entry['threshold'], **kwargs)
+        return self._get('rules', name, build)
+
+    def titrator(self, name : str) -> type[Titrator]:
+        def build(name, entry):
+            class_name = entry.get('class_name') or "".join(part.title() for part in name.split("_")) + "Titrator"
+            return _CatalogTitratorType(class_name, (Titrator,), {
+                'dosing_ladder': self.ladder(entry['ladder']),
+                'default_rules': [self.rule(rule) for rule in entry.get('rules', [])],
+                '_catalog': self,
+                '_catalog_name': name,
+            })
+        return self._get('titrators', name, build)
+
+    @property
+    def titrator_names(self) -> List[str]:
+        return list(self.spec['titrators'])
+
+class _CatalogTitratorType(type):
+    "The type of the titrator classes a `Catalog` builds; see `_reduce_titrator_class`."
+
+# Catalogs that titrator classes were pickled from or unpickled into, by path, so that a class
+# unpickled in the same process is the same class, and a worker loads each catalog only once
+_catalogs : Dict[str, Catalog] = {}
+
+def _catalog_titrator(path : str, name : str) -> type[Titrator]:
+    if path not in _catalogs: _catalogs[path] = load_catalog(path)
+    return _catalogs[path].titrator(name)
+
+def _spec_titrator(spec : Dict[str, Dict[str, Any]], name : str) -> type[Titrator]:
+    return Catalog(spec, validate=False).titrator(name)
+
+def _reduce_titrator_class(cls : _CatalogTitratorType):
+    # Classes are otherwise pickled by their qualified name, which does not resolve for built classes;
+    # subclasses defined in code (which inherit the metaclass) still are.
+    catalog, name = cls.__dict__.get('_catalog'), cls.__dict__.get('_catalog_name')
+    if catalog is None: return cls.__qualname__
+    if catalog.path is not None:
+        path = str(catalog.path.resolve())
+        _catalogs.setdefault(path, catalog)
+        return _catalog_titrator, (path, name)
+    return _spec_titrator, ({section: dict(catalog.spec[section]) for section in SECTIONS}, name)
+
+copyreg.pickle(_CatalogTitratorType, _reduce_titrator_class)
+
+def compile_catalog(json_path : str | Path, binary_path : str | Path) -> Catalog:
+    "Validate the JSON catalog at `json_path` and write its compiled form to `binary_path`."
+    catalog = Catalog.from_json(json_path)
+    catalog.to_binary(binary_path)
+    return catalog
+
+def load_catalog(path : str | Path) -> Catalog:
+    "Load a JSON or compiled catalog, depending on the file's contents."
+    with open(path, "rb") as f: is_binary = f.read(len(_MAGIC)) == _MAGIC
+    return Catalog.from_binary(path) if is_binary else Catalog.from_json(path)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Validate a JSON catalog and compile it to the binary form.")
+    parser.add_argument("json_path")
+    parser.add_argument("binary_path")
+    args = parser.parse_args()
+    catalog = compile_catalog(args.json_path, args.binary_path)
+    print(f"Compiled {len(catalog.spec['titrators'])} titrators and {len(catalog.spec['rules'])} rules to {args.binary_path}")
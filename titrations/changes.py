@@ -0,0 +1,92 @@
+__all__ = ['ChangeDetector']
+
+import json
+import sqlite3
+from hashlib import blake2b
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+class ChangeDetector:
+    """
+    Keeps a 16-byte digest of the last recommendation (satisfied rules and recommended action types)
+    of every patient and titrator in a SQLite database, and reduces a run's recommendation rows (as
+    produced by `pipeline.recommend`) to the rows that differ from the previous run. Each emitted row
+    carries a `change` of `'added'`, `'changed'` or `'removed'`.
+    """
+    def __init__(self, path : str | Path, batch_size : int = 1000) -> None:
+        assert batch_size > 0, "Batch size must be positive."
+        self.path = path
+        self.batch_size = batch_size
+        self.counts = {}
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS digests (
+                patient_id TEXT NOT NULL, titrator TEXT NOT NULL, digest BLOB NOT NULL, run INTEGER NOT NULL,
+                PRIMARY KEY (patient_id, titrator)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, started TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP);
+        """)
+
+    @staticmethod
+    def digest(row : Dict[str, Any]) -> bytes:
+        content = json.dumps([sorted(row['satisfied_rules']), sorted(row['recommended_actions'])])
+        return blake2b(content.encode(), digest_size=16).digest()
+
+    def _previous(self, batch : List[Dict[str, Any]]) -> Dict[tuple, bytes]:
+        patient_ids = list(dict.fromkeys(str(row['patient_id']) for row in batch))
+        previous = {}
+        for i in range(0, len(patient_ids), 500):  # stay below SQLite's bound parameter limit
+            chunk = patient_ids[i:i + 500]
+            query = f"SELECT patient_id, titrator, digest FROM digests WHERE patient_id IN ({', '.join('?' * len(chunk))})"
+            previous.update(((patient_id, titrator), digest) for patient_id, titrator, digest in self.connection.execute(query, chunk))
+        return previous
+
+    def diff(self, rows : Iterable[Dict[str, Any]], complete : bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the rows whose recommendation was added or changed since the last run and record the new
+        digests. If the run is `complete` (it covered every patient), a `'removed'` row is yielded for
+        each patient and titrator that was not seen, and its digest is dropped. The store is updated in
+        a single transaction when the rows are exhausted.
+        """
+        self.counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        rows = iter(rows)
+        try:
+            run = self.connection.execute("INSERT INTO runs DEFAULT VALUES").lastrowid
+            while batch := list(islice(rows, self.batch_size)):
+                previous = self._previous(batch)
+                updates = []
+                for row in batch:
+                    key = (str(row['patient_id']), row['titrator'])
+                    digest = self.digest(row)
+                    updates.append((*key, digest, run))
+                    before = previous.get(key)
+                    if before == digest:
+                        self.counts['unchanged'] += 1
+                        continue
+                    change = 'added' if before is None else 'changed'
+                    self.counts[change] += 1
+                    yield {'change': change, **row}
+                self.connection.executemany(
+                    "INSERT INTO digests VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (patient_id, titrator) DO UPDATE SET digest = excluded.digest, run = excluded.run", updates)
+
+            if complete:
+                removed = self.connection.execute("SELECT patient_id, titrator FROM digests WHERE run < ?", (run,)).fetchall()
+                for patient_id, titrator in removed:
+                    self.counts['removed'] += 1
+                    yield {'change': 'removed', 'patient_id': patient_id, 'titrator': titrator}
+                self.connection.execute("DELETE FROM digests WHERE run < ?", (run,))
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'ChangeDetector':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,152 @@
+"""
+Bulk patient loading from, and recommendation writing to, a local SQLite database.
+
+    python -m titrations.database patients.db --page-size 5000
+
+Patients are read a page at a time with one set-based query per table (see `SCHEMA`), and
+recommendations are written back with batched `executemany` upserts, one transaction per page,
+on the same connection.
+"""
+
+__all__ = ['SCHEMA', 'create_schema', 'read_patients', 'RecommendationWriter', 'run_database']
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .basics import *
+from .titrations2 import *
+from .pipeline import MedicationResolver, PipelineStats, recommend, _Counted, _default_ladders, _default_titrator_classes
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    {', '.join(f"{parameter} {'REAL' if parameter in NUMERIC_PARAMETERS else 'INTEGER'}" for parameter in VALID_PARAMETERS)}
+);
+CREATE TABLE IF NOT EXISTS medications (
+    patient_id TEXT NOT NULL REFERENCES patients, ingredient TEXT NOT NULL, dose TEXT NOT NULL,
+    route TEXT NOT NULL DEFAULT 'PO', frequency TEXT NOT NULL DEFAULT 'daily'
+);
+CREATE INDEX IF NOT EXISTS medications_patient_id ON medications (patient_id);
+CREATE TABLE IF NOT EXISTS reactions (
+    patient_id TEXT NOT NULL REFERENCES patients, ingredient TEXT NOT NULL, description TEXT NOT NULL DEFAULT 'reaction'
+);
+CREATE INDEX IF NOT EXISTS reactions_patient_id ON reactions (patient_id);
+CREATE TABLE IF NOT EXISTS max_tolerated (
+    patient_id TEXT NOT NULL REFERENCES patients, ingredient TEXT NOT NULL, dose TEXT NOT NULL,
+    route TEXT NOT NULL DEFAULT 'PO', frequency TEXT NOT NULL DEFAULT 'daily'
+);
+CREATE INDEX IF NOT EXISTS max_tolerated_patient_id ON max_tolerated (patient_id);
+CREATE TABLE IF NOT EXISTS recommendations (
+    patient_id TEXT NOT NULL, titrator TEXT NOT NULL, can_advance INTEGER NOT NULL,
+    satisfied_rules TEXT NOT NULL, recommended_actions TEXT NOT NULL,
+    PRIMARY KEY (patient_id, titrator)
+);
+"""
+
+def create_schema(connection : sqlite3.Connection) -> None:
+    "Create the tables `read_patients` and `RecommendationWriter` use, if they do not exist."
+    connection.executescript(SCHEMA)
+
+# The patient ids of one page, shared by the page's queries so that each table is read with one statement
+_PAGE = "SELECT patient_id FROM patients WHERE patient_id > ? ORDER BY patient_id LIMIT ?"
+
+def _group_by_patient(rows : Iterable[tuple]) -> Dict[str, List[tuple]]:
+    grouped = {}
+    for patient_id, *fields in rows: grouped.setdefault(patient_id, []).append(fields)
+    return grouped
+
+def read_patients(connection : sqlite3.Connection,
+                  resolver : Optional[MedicationResolver] = None,
+                  page_size : int = 1000) -> Iterator[Tuple[str, Patient]]:
+    """
+    Lazily read `(patient_id, Patient)` pairs in patient id order, `page_size` patients at a time.
+    Medications and max tolerated doses are resolved to the steps of `resolver`'s ladders (the
+    example ladders by default).
+    """
+    assert page_size > 0, "Page size must be positive."
+    resolver = resolver or MedicationResolver(_default_ladders())
+    columns = ", ".join(VALID_PARAMETERS)
+    last_id = ""
+    while True:
+        page = (last_id, page_size)
+        rows = connection.execute(f"SELECT patient_id, {columns} FROM patients WHERE patient_id IN ({_PAGE}) ORDER BY patient_id", page).fetchall()
+        if not rows: return
+        medications = _group_by_patient(connection.execute(
+            f"SELECT patient_id, ingredient, dose, route, frequency FROM medications WHERE patient_id IN ({_PAGE}) ORDER BY rowid", page))
+        reactions = _group_by_patient(connection.execute(
+            f"SELECT patient_id, ingredient, description FROM reactions WHERE patient_id IN ({_PAGE}) ORDER BY rowid", page))
+        max_tolerated = _group_by_patient(connection.execute(
+            f"SELECT patient_id, ingredient, dose, route, frequency FROM max_tolerated WHERE patient_id IN ({_PAGE}) ORDER BY rowid", page))
+
+        for patient_id, *values in rows:
+            parameters = {parameter: float(value) if parameter in NUMERIC_PARAMETERS else bool(value)
+                          for parameter, value in zip(VALID_PARAMETERS, values) if value is not None}
+            max_tolerated_meds = (resolver.resolve(*fields) for fields in max_tolerated.get(patient_id, []))
+            yield patient_id, Patient(
+                medications=[resolver.resolve(*fields) for fields in medications.get(patient_id, [])],
+                reactions=[Reaction(resolver.interner.ingredient(name), description) for name, description in reactions.get(patient_id, [])],
+                max_tolerated={med.name: med for med in max_tolerated_meds},
+                **parameters)
+        last_id = rows[-1][0]
+
+class RecommendationWriter:
+    """
+    Upserts recommendation rows (as produced by `pipeline.recommend`) into the `recommendations`
+    table, `batch_size` rows per `executemany`, each batch in its own transaction.
+    """
+    def __init__(self, connection : sqlite3.Connection, batch_size : int = 1000) -> None:
+        assert batch_size > 0, "Batch size must be positive."
+        self.connection = connection
+        self.batch_size = batch_size
+
+    def _flush(self, batch : List[tuple]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO recommendations VALUES (?, ?, ?, ?, ?) ON CONFLICT (patient_id, titrator) DO UPDATE SET "
+                "can_advance = excluded.can_advance, satisfied_rules = excluded.satisfied_rules, "
+                "recommended_actions = excluded.recommended_actions", batch)
+
+    def write(self, rows : Iterable[Dict[str, Any]]) -> int:
+        "Write `rows` as they are produced; returns the number of rows written."
+        count, batch = 0, []
+        for row in rows:
+            batch.append((str(row['patient_id']), row['titrator'], int(row['can_advance']),
+                          json.dumps(row['satisfied_rules']), json.dumps(row['recommended_actions'])))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                count, batch = count + len(batch), []
+        if batch: self._flush(batch)
+        return count + len(batch)
+
+def run_database(path : str | Path,
+                 titrator_classes : Optional[List[type[Titrator]]] = None,
+                 resolver : Optional[MedicationResolver] = None,
+                 page_size : int = 1000,
+                 compiled : bool = True) -> PipelineStats:
+    """
+    Run `titrator_classes` (the four example titrators by default) over every patient in the SQLite
+    database at `path` and write the recommendations back to it. `page_size` sets both how many
+    patients are read per query and how many rows are written per transaction.
+    """
+    titrator_classes = titrator_classes or _default_titrator_classes()
+    connection = sqlite3.connect(str(path))
+    try:
+        create_schema(connection)
+        patients = _Counted(read_patients(connection, resolver, page_size))
+        start = time.perf_counter()
+        rows = recommend(patients, titrator_classes, compiled)
+        written = RecommendationWriter(connection, batch_size=page_size).write(rows)
+        return PipelineStats(patients.count, written, time.perf_counter() - start)
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the example titrators over the patients in a SQLite database.")
+    parser.add_argument("path")
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+    print(run_database(args.path, page_size=args.page_size))
@@ -52,7 +52,7 @@ av_block = TitrationLimitingRule('av_block', 'eq', True)
 # %% ../examples.ipynb 8
 class BetaBlockerTitrator(Titrator):
     dosing_ladder = beta_blocker_ladder
-    rules = [
+    default_rules = [
         hypotension,
         bradycardia,
         decompensation,
@@ -98,7 +98,7 @@ symptoms
 # %% ../examples.ipynb 15
 class RAASiTitrator(Titrator):
     dosing_ladder = raasi_ladder
-    rules = [
+    default_rules = [
         low_egfr,
         hyperkalemia,
         hypotension,
@@ -130,7 +130,7 @@ has_type_2_diabetes_on_insulin = NonLimitingRule('has_type_2_diabetes_on_insulin
 # %% ../examples.ipynb 22
 class SGLT2iTitrator(Titrator):
     dosing_ladder = sglt2i_ladder
-    rules = [
+    default_rules = [
         low_egfr,
         severe_gu_infxns,
         has_type_1_diabetes,
@@ -157,7 +157,7 @@ mra_ladder = DosingLadder({
 # %% ../examples.ipynb 34
 class MRATitrator(Titrator):
     dosing_ladder = mra_ladder
-    rules = [
+    default_rules = [
         low_egfr,
         hyperkalemia,
         # TODO
@@ -0,0 +1,231 @@
+__all__ = ['PatientFrame', 'PatientRow', 'FrameEvaluation']
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .basics import *
+from .titrations2 import *
+from .titrations2 import _is_inlinable
+
+class PatientFrame:
+    """
+    A cohort stored column-wise: each of `VALID_PARAMETERS` is a typed NumPy column (float for labs
+    and vitals, bool for flags) with a validity mask, and each patient's current medication and max
+    tolerated dose on each of `ladders` are (ingredient code, step index) integer pairs, where the
+    ingredient code indexes `ladder.ingredients` and -1 means none.
+
+    Medications that are on none of `ladders`, and reactions, are not kept.
+    """
+    ladders : Dict[str, DosingLadder]
+    values : Dict[str, np.ndarray]
+    valid : Dict[str, np.ndarray]
+    ingredient_code : Dict[str, np.ndarray]
+    step : Dict[str, np.ndarray]
+    max_tolerated_ingredient_code : Dict[str, np.ndarray]
+    max_tolerated_step : Dict[str, np.ndarray]
+
+    def __init__(self, size : int, ladders : Dict[str, DosingLadder]) -> None:
+        self.size = size
+        self.ladders = ladders
+        self.values = {p: np.zeros(size, dtype=np.float64 if p in NUMERIC_PARAMETERS else bool) for p in VALID_PARAMETERS}
+        self.valid = {p: np.zeros(size, dtype=bool) for p in VALID_PARAMETERS}
+        self.ingredient_code, self.step, self.max_tolerated_ingredient_code, self.max_tolerated_step = \
+            [{name: np.full(size, -1, dtype=np.int16) for name in ladders} for _ in range(4)]
+
+    @classmethod
+    def from_patients(cls, patients : List[Patient], ladders : Dict[str, DosingLadder]) -> 'PatientFrame':
+        frame = cls(len(patients), ladders)
+        codes = {name: {ingredient.name: code for code, ingredient in enumerate(ladder.ingredients)} for name, ladder in ladders.items()}
+        for i, patient in enumerate(patients):
+            for parameter in VALID_PARAMETERS:
+                value = getattr(patient, parameter, None)
+                if value is not None:
+                    frame.values[parameter][i] = value
+                    frame.valid[parameter][i] = True
+            for name, ladder in ladders.items():
+                current = ladder.get_current_medication_for_patient(patient)
+                if current is None: continue
+                frame.ingredient_code[name][i], frame.step[name][i] = frame._encode(name, codes[name], current)
+                max_tolerated = patient.max_tolerated.get(current.name) if patient.max_tolerated else None
+                if max_tolerated is not None:
+                    frame.max_tolerated_ingredient_code[name][i], frame.max_tolerated_step[name][i] = \
+                        frame._encode(name, codes[name], max_tolerated)
+        return frame
+
+    def _encode(self, ladder_name : str, codes : Dict[str, int], med : Medication) -> tuple:
+        step = self.ladders[ladder_name]._get_current_step_index(med)
+        if step is None: raise ValueError(f"{med} is not a step on the `{ladder_name}` ladder.")
+        return codes[med.name], step
+
+    def _decode(self, ladder_name : str, code : int, step : int) -> Optional[Medication]:
+        if code < 0: return None
+        ladder = self.ladders[ladder_name]
+        return ladder.ladder[ladder.ingredients[code].name][step]
+
+    def take(self, indices : np.ndarray) -> 'PatientFrame':
+        "A new frame holding copies of the rows at `indices` (which may repeat rows)."
+        frame = PatientFrame(len(indices), self.ladders)
+        for source, target in [(self.values, frame.values), (self.valid, frame.valid), (self.ingredient_code, frame.ingredient_code),
+                               (self.step, frame.step), (self.max_tolerated_ingredient_code, frame.max_tolerated_ingredient_code),
+                               (self.max_tolerated_step, frame.max_tolerated_step)]:
+            for key, column in source.items(): target[key] = column[indices]
+        return frame
+
+    def copy(self) -> 'PatientFrame':
+        return self.take(np.arange(self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        "The parameters as masked arrays, in the form taken by `Rule.evaluate_batch`."
+        return {p: np.ma.masked_array(self.values[p], mask=~self.valid[p]) for p in VALID_PARAMETERS}
+
+    def row(self, i : int) -> 'PatientRow':
+        if not 0 <= i < self.size: raise IndexError(i)
+        return PatientRow(self, i)
+
+    def __iter__(self):
+        return (PatientRow(self, i) for i in range(self.size))
+
+    def _ladder_name(self, dosing_ladder : DosingLadder) -> str:
+        for name, ladder in self.ladders.items():
+            if ladder is dosing_ladder: return name
+        raise ValueError("The titrator's dosing ladder is not one of the frame's ladders.")
+
+    def _daily_dose_table(self, ladder_name : str) -> np.ndarray:
+        "The total daily dose of every step of the ladder, by (ingredient code, step index); NaN pads short subladders."
+        ladder = self.ladders[ladder_name]
+        subladders = [ladder.ladder[ingredient.name] for ingredient in ladder.ingredients]
+        table = np.full((len(subladders), max(map(len, subladders))), np.nan)
+        for code, subladder in enumerate(subladders):
+            table[code, :len(subladder)] = [np.nan if med.daily_dose is None else med.daily_dose for med in subladder]
+        return table
+
+    def daily_dose(self, ladder_name : str) -> np.ndarray:
+        "Each patient's total daily dose on the ladder; NaN for patients not on it."
+        code, step = self.ingredient_code[ladder_name], self.step[ladder_name]
+        doses = self._daily_dose_table(ladder_name)[np.maximum(code, 0), np.maximum(step, 0)]
+        return np.where(code >= 0, doses, np.nan)
+
+    def target_daily_dose(self, ladder_name : str) -> np.ndarray:
+        "The daily dose of the highest step of each patient's subladder; NaN for patients not on the ladder."
+        code = self.ingredient_code[ladder_name]
+        ladder = self.ladders[ladder_name]
+        targets = np.array([np.nan if (dose := ladder.get_target_daily_dose(ingredient)) is None else dose
+                            for ingredient in ladder.ingredients])
+        return np.where(code >= 0, targets[np.maximum(code, 0)], np.nan)
+
+    def fraction_of_target_dose(self, ladder_name : str) -> np.ndarray:
+        """
+        Each patient's daily dose as a fraction of their target daily dose, e.g. patients below half
+        of the target are `frame.fraction_of_target_dose(name) < 0.5` (NaN compares false).
+        """
+        return self.daily_dose(ladder_name) / self.target_daily_dose(ladder_name)
+
+    def _max_tolerated_mask(self, ladder_name : str) -> np.ndarray:
+        code, step = self.ingredient_code[ladder_name], self.step[ladder_name]
+        return (code >= 0) & (code == self.max_tolerated_ingredient_code[ladder_name]) & (step == self.max_tolerated_step[ladder_name])
+
+    def evaluate(self, titrator_class : type[Titrator],
+                 masks : Optional[Dict[Rule, np.ndarray]] = None,
+                 columns : Optional[Dict[str, np.ndarray]] = None) -> 'FrameEvaluation':
+        """
+        Evaluate `titrator_class` (with the default `MaxTolerated` titration target) for every patient.
+        Plain comparison rules are evaluated column-wise; other rules fall back to evaluating each row.
+        Each rule's satisfied mask is looked up in (and added to) `masks` when it is given.
+        """
+        ladder_name = self._ladder_name(titrator_class.dosing_ladder)
+        rules = list(titrator_class.default_rules)
+        columns = self.columns if columns is None else columns
+        masks = {} if masks is None else masks
+        satisfied = np.zeros((self.size, len(rules) + 1), dtype=bool)
+        for j, rule in enumerate(rules):
+            if rule not in masks:
+                if _is_inlinable(rule): masks[rule] = rule.evaluate_batch(columns)
+                else: masks[rule] = np.array([rule.evaluate(row).is_satisfied for row in self], dtype=bool)
+            satisfied[:, j] = masks[rule]
+        satisfied[:, -1] = self._max_tolerated_mask(ladder_name)
+
+        evaluation = FrameEvaluation(titrator_class, rules + [MaxTolerated(titrator_class.dosing_ladder)], satisfied)
+        initiating = self.ingredient_code[ladder_name] < 0
+        can_advance = evaluation.can_advance
+        action_bits = np.zeros(self.size, dtype=np.uint64)
+        for j, rule in enumerate(evaluation.rules):
+            if _is_inlinable(rule) or isinstance(rule, MaxTolerated):
+                bits = evaluation.encode(getattr(rule, 'actions_when_satisfied', []))
+                action_bits[satisfied[:, j]] |= np.uint64(bits)
+            else:
+                for i in np.flatnonzero(satisfied[:, j]):
+                    action_bits[i] |= np.uint64(evaluation.encode(rule.evaluate(self.row(int(i))).recommended_actions))
+        action_bits[can_advance & initiating] = evaluation.encode(titrator_class.default_initiation_actions)
+        action_bits[can_advance & ~initiating] = evaluation.encode(titrator_class.default_titration_actions)
+        evaluation.action_bits = action_bits
+        return evaluation
+
+    def evaluate_all(self, titrator_classes : List[type[Titrator]]) -> Dict[type[Titrator], 'FrameEvaluation']:
+        "Evaluate each of `titrator_classes`, evaluating rules they share only once."
+        masks, columns = {}, self.columns
+        return {titrator_class: self.evaluate(titrator_class, masks, columns) for titrator_class in titrator_classes}
+
+class FrameEvaluation:
+    """
+    The outcome of evaluating a titrator over a `PatientFrame`: a patients-by-rules `satisfied` matrix
+    (the titration target is the last rule) and the recommended actions of each patient as a bitmask
+    over `action_types`.
+    """
+    def __init__(self, titrator_class : type[Titrator], rules : List[Rule], satisfied : np.ndarray) -> None:
+        self.titrator_class = titrator_class
+        self.rules = rules
+        self.satisfied = satisfied
+        self.action_types = []
+        self.action_bits = None
+
+    def encode(self, actions : List[type[Action]]) -> int:
+        bits = 0
+        for action in actions:
+            if action not in self.action_types: self.action_types.append(action)
+            bits |= 1 << self.action_types.index(action)
+        return bits
+
+    @property
+    def can_advance(self) -> np.ndarray:
+        return ~self.satisfied.any(axis=1)
+
+    def satisfied_rules(self, i : int) -> List[Rule]:
+        return [rule for rule, is_satisfied in zip(self.rules, self.satisfied[i]) if is_satisfied]
+
+    def recommended_actions(self, i : int) -> List[type[Action]]:
+        bits = int(self.action_bits[i])
+        return [action for code, action in enumerate(self.action_types) if bits >> code & 1]
+
+class PatientRow(Patient):
+    "A read-only `Patient` view of one row of a `PatientFrame`."
+    __slots__ = ('_frame', '_index')
+
+    def __init__(self, frame : PatientFrame, index : int) -> None:
+        object.__setattr__(self, '_frame', frame)
+        object.__setattr__(self, '_index', index)
+
+    def __getattr__(self, name : str) -> Any:
+        # Only reached for attributes that are not stored on the row itself, i.e. all patient data
+        frame, i = self._frame, self._index
+        if name in VALID_PARAMETERS:
+            if not frame.valid[name][i]: raise AttributeError(name)
+            value = frame.values[name][i]
+            return float(value) if name in NUMERIC_PARAMETERS else bool(value)
+        if name == 'medications':
+            meds = [frame._decode(ladder, frame.ingredient_code[ladder][i], frame.step[ladder][i]) for ladder in frame.ladders]
+            return [med for med in meds if med is not None]
+        if name == 'max_tolerated':
+            meds = [frame._decode(ladder, frame.max_tolerated_ingredient_code[ladder][i], frame.max_tolerated_step[ladder][i])
+                    for ladder in frame.ladders]
+            return {med.name: med for med in meds if med is not None}
+        if name == 'reactions':
+            return []
+        raise AttributeError(name)
+
+    def __setattr__(self, name : str, value : Any) -> None:
+        raise AttributeError("Rows of a PatientFrame are read-only.")
@@ -0,0 +1,171 @@
+__all__ = ['MedicationResolver', 'patient_from_row', 'read_patients', 'recommend', 'write_recommendations',
+           'PipelineStats', 'run_pipeline']
+
+import csv
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .basics import *
+from .titrations2 import *
+from .changes import ChangeDetector
+
+class MedicationResolver:
+    """
+    Resolves (ingredient name, dose) pairs to the matching step of one of `dosing_ladders`, so that
+    patients read from a file share the ladders' `Medication` objects. Medications that are on no
+    ladder are interned, so they are shared too.
+    """
+    def __init__(self, dosing_ladders : List[DosingLadder]) -> None:
+        self.dosing_ladders = dosing_ladders
+        self.interner = MedicationInterner([med for ladder in dosing_ladders for subladder in ladder.ladder.values() for med in subladder])
+
+    def resolve(self, name : str, dose : str, route : str = "PO", frequency : str = "daily") -> Medication:
+        for ladder in self.dosing_ladders:
+            step = ladder.get_step(name, dose)
+            if step is not None: return step
+        return self.interner.intern(name, dose, route, frequency)
+
+def _default_ladders() -> List[DosingLadder]:
+    from .examples import beta_blocker_ladder, raasi_ladder, sglt2i_ladder, mra_ladder
+    return [beta_blocker_ladder, raasi_ladder, sglt2i_ladder, mra_ladder]
+
+def _default_titrator_classes() -> List[type[Titrator]]:
+    from .examples import BetaBlockerTitrator, RAASiTitrator, SGLT2iTitrator, MRATitrator
+    return [BetaBlockerTitrator, RAASiTitrator, SGLT2iTitrator, MRATitrator]
+
+def _parse_value(parameter : str, value : Any) -> Any:
+    if not isinstance(value, str): return value
+    value = value.strip()
+    if value == "": return None
+    if parameter in NUMERIC_PARAMETERS: return float(value)
+    if value.lower() in ("true", "1", "yes"): return True
+    if value.lower() in ("false", "0", "no"): return False
+    raise ValueError(f"Invalid value {value!r} for `{parameter}`.")
+
+def _parse_medications(value : Any) -> List[Dict[str, str]]:
+    # JSONL rows carry a list of {"ingredient": ..., "dose": ...} objects; CSV cells carry
+    # "ingredient:dose" entries separated by semicolons.
+    if not value: return []
+    if isinstance(value, list): return value
+    entries = [entry.split(":", 1) for entry in value.split(";") if entry.strip()]
+    return [{'ingredient': name.strip(), 'dose': dose.strip()} for name, dose in entries]
+
+def _read_rows(path : Path) -> Iterator[Dict[str, Any]]:
+    with open(path, newline="") as f:
+        if path.suffix == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip(): yield json.loads(line)
+
+def patient_from_row(row : Dict[str, Any], resolver : MedicationResolver) -> Patient:
+    """
+    Build a `Patient` from a row holding any of `VALID_PARAMETERS`, and `medications`/`max_tolerated`
+    listings of ingredient name and dose.
+    """
+    medications = [resolver.resolve(med['ingredient'], med['dose'], med.get('route', "PO"), med.get('frequency', "daily"))
+                   for med in _parse_medications(row.get('medications'))]
+    max_tolerated = {med.name: med for med in
+                     (resolver.resolve(entry['ingredient'], entry['dose']) for entry in _parse_medications(row.get('max_tolerated')))}
+    parameters = {parameter: _parse_value(parameter, row[parameter]) for parameter in VALID_PARAMETERS if parameter in row}
+    parameters = {parameter: value for parameter, value in parameters.items() if value is not None}
+    return Patient(medications=medications, max_tolerated=max_tolerated, **parameters)
+
+def read_patients(path : str | Path, resolver : Optional[MedicationResolver] = None) -> Iterator[Tuple[str, Patient]]:
+    "Lazily read `(patient_id, Patient)` pairs from a CSV or JSONL file of rows as described in `patient_from_row`, plus an `id`."
+    path = Path(path)
+    resolver = resolver or MedicationResolver(_default_ladders())
+    for i, row in enumerate(_read_rows(path)):
+        yield str(row.get('id', i)), patient_from_row(row, resolver)
+
+def recommend(patients : Iterable[Tuple[str, Patient]],
+              titrator_classes : List[type[Titrator]],
+              compiled : bool = True) -> Iterator[Dict[str, Any]]:
+    "Run `titrator_classes` over `(patient_id, Patient)` pairs, yielding one recommendation row per patient and titrator."
+    for patient_id, patient in patients:
+        group = TitratorGroup.from_titrator_types(patient, titrator_classes)
+        group.evaluate(compiled=compiled)
+        for titrator in group.titrators:
+            yield {
+                'patient_id': patient_id,
+                'titrator': type(titrator).__name__,
+                'can_advance': titrator.can_advance,
+                'satisfied_rules': [repr(rule) for rule in titrator.satisfied_rules],
+                'recommended_actions': sorted(type(action).__name__ for action in titrator.recommended_actions),
+            }
+
+_OUTPUT_FIELDS = ['patient_id', 'titrator', 'can_advance', 'satisfied_rules', 'recommended_actions']
+
+def write_recommendations(rows : Iterable[Dict[str, Any]], path : str | Path, fields : List[str] = _OUTPUT_FIELDS) -> int:
+    "Write recommendation rows to a CSV or JSONL file as they are produced; returns the number of rows written."
+    path = Path(path)
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields) if path.suffix == ".csv" else None
+        if writer: writer.writeheader()
+        for row in rows:
+            if writer: writer.writerow({k: "; ".join(v) if isinstance(v, list) else v for k, v in row.items()})
+            else: f.write(json.dumps(row) + "\n")
+            count += 1
+    return count
+
+class PipelineStats:
+    __slots__ = ('patients', 'rows', 'seconds')
+
+    def __init__(self, patients : int, rows : int, seconds : float) -> None:
+        self.patients = patients
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def patients_per_second(self) -> float:
+        return self.patients / self.seconds if self.seconds else float("inf")
+
+    def __repr__(self) -> str:
+        return f"{self.patients} patients, {self.rows} rows in {self.seconds:.2f}s ({self.patients_per_second:.0f} patients/s)"
+
+class _Counted:
+    "Iterates over `items`, counting them in `count` as they are consumed."
+    def __init__(self, items : Iterable[Any]) -> None:
+        self.items = items
+        self.count = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        for item in self.items:
+            self.count += 1
+            yield item
+
+def run_pipeline(input_path : str | Path,
+                 output_path : str | Path,
+                 titrator_classes : Optional[List[type[Titrator]]] = None,
+                 resolver : Optional[MedicationResolver] = None,
+                 changes_path : Optional[str | Path] = None) -> PipelineStats:
+    """
+    Stream patients from `input_path` through `titrator_classes` (the four example titrators by
+    default) into `output_path`. Only one patient is held in memory at a time.
+
+    With `changes_path`, only the recommendations that were added, changed or removed since the last
+    run against the same SQLite store (see `ChangeDetector`) are written, with a `change` column.
+    """
+    titrator_classes = titrator_classes or _default_titrator_classes()
+
+    patients = _Counted(read_patients(input_path, resolver))
+    start = time.perf_counter()
+    rows = recommend(patients, titrator_classes)
+    if changes_path is None:
+        written = write_recommendations(rows, output_path)
+    else:
+        with ChangeDetector(changes_path) as detector:
+            written = write_recommendations(detector.diff(rows), output_path, ['change'] + _OUTPUT_FIELDS)
+    return PipelineStats(patients.count, written, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the example titrators over a CSV or JSONL file of patients.")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--changes-db", default=None, help="SQLite store of the last run's digests; write only the changes")
+    args = parser.parse_args()
+    print(run_pipeline(args.input_path, args.output_path, changes_path=args.changes_db))
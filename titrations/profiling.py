@@ -0,0 +1,200 @@
+"""
+Opt-in profiling of rule, titrator and action calls.
+
+    profiler = Profiler()
+    with profiler:
+        ...  # evaluate titrators
+    profiler.write_json("profile.json")
+    profiler.write_prometheus("profile.prom")
+
+While enabled, the profiler replaces `evaluate` on `Rule`, the `evaluate` methods of `Titrator` and
+`suggest` on `Action` (and on any subclass overriding them) with timed wrappers; disabling restores
+the originals, so there is no cost when profiling is off. Functions returned by `Titrator.compile`
+and `TitratorGroup.compile` are the generated ones, wrapped to count each call under the titrator
+kind (e.g. `BetaBlockerTitrator.compile()`), so compiled evaluation is measured as it runs in
+production. Generated code inlines most rules, so rule counters only cover uncompiled evaluation:
+calls to `Rule.evaluate` made from inside generated code are not counted.
+"""
+
+__all__ = ['Counter', 'Profiler']
+
+import json
+import time
+from collections import deque
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from .titrations2 import *
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+class Counter:
+    "Call count, satisfied count and timings for one rule, titrator or action type."
+    __slots__ = ('calls', 'satisfied', 'seconds', 'samples')
+
+    def __init__(self, window : int) -> None:
+        self.calls = 0
+        self.satisfied = 0
+        self.seconds = 0.0
+        self.samples = deque(maxlen=window)  # the most recent call durations, for percentiles
+
+    def record(self, seconds : float, satisfied : bool = False) -> None:
+        self.calls += 1
+        self.satisfied += satisfied
+        self.seconds += seconds
+        self.samples.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        quantiles = np.quantile(np.array(self.samples), QUANTILES) if self.samples else [0.0] * len(QUANTILES)
+        return {
+            'calls': self.calls,
+            'satisfied': self.satisfied,
+            'seconds': self.seconds,
+            'quantiles': {str(q): float(value) for q, value in zip(QUANTILES, quantiles)},
+        }
+
+def _subclasses(cls : type) -> List[type]:
+    found = [cls]
+    for subclass in cls.__subclasses__(): found += _subclasses(subclass)
+    return found
+
+class Profiler:
+    """
+    Records counters keyed by kind (`rule`, `titrator` or `action`) and name. A rule's satisfied count
+    is the number of evaluations that satisfied it; a titrator's is the number that held titration.
+    """
+    _enabled = None  # the profiler currently patched in, if any
+
+    def __init__(self, window : int = 10_000) -> None:
+        self.window = window
+        self.counters : Dict[Tuple[str, str], Counter] = {}
+        self._originals = []
+        self._evaluating = set()  # ids of the titrators inside a wrapped call, so nested calls count once
+        self._generated = 0  # the depth of calls to compiled functions, inside which rules are not counted
+
+    def _counter(self, kind : str, name : str) -> Counter:
+        key = (kind, name)
+        if key not in self.counters: self.counters[key] = Counter(self.window)
+        return self.counters[key]
+
+    def _wrap_rule_evaluate(self, evaluate : Callable) -> Callable:
+        @wraps(evaluate)
+        def wrapper(rule, patient):
+            start = time.perf_counter()
+            result = evaluate(rule, patient)
+            if self._generated: return result
+            self._counter('rule', f"{type(rule).__name__}({rule!r})").record(time.perf_counter() - start, result.is_satisfied)
+            return result
+        return wrapper
+
+    def _wrap_titrator_evaluate(self, evaluate : Callable) -> Callable:
+        @wraps(evaluate)
+        def wrapper(titrator, *args, **kwargs):
+            # `evaluate(compiled=True)` calls `evaluate_compiled`, and overrides may call each other
+            if id(titrator) in self._evaluating: return evaluate(titrator, *args, **kwargs)
+            self._evaluating.add(id(titrator))
+            try:
+                start = time.perf_counter()
+                result = evaluate(titrator, *args, **kwargs)
+                self._counter('titrator', type(titrator).__name__).record(time.perf_counter() - start, not titrator.can_advance)
+                return result
+            finally: self._evaluating.discard(id(titrator))
+        return wrapper
+
+    def _wrap_compile(self, compile : classmethod, name : Callable[..., str], held : Callable[[Any], bool]) -> classmethod:
+        "Wrap a `compile` classmethod so that the functions it returns count their calls."
+        function = compile.__func__
+        @wraps(function)
+        def wrapper(cls, *args):
+            compiled = function(cls, *args)
+            counter = self._counter('titrator', name(cls, *args))
+            def timed(patient):
+                self._generated += 1
+                try:
+                    start = time.perf_counter()
+                    evaluated = compiled(patient)
+                finally: self._generated -= 1
+                counter.record(time.perf_counter() - start, held(evaluated))
+                return evaluated
+            return timed
+        return classmethod(wrapper)
+
+    def _wrap_action_suggest(self, suggest : Callable) -> Callable:
+        @wraps(suggest)
+        def wrapper(action, *args, **kwargs):
+            start = time.perf_counter()
+            try: return suggest(action, *args, **kwargs)
+            finally: self._counter('action', type(action).__name__).record(time.perf_counter() - start)
+        return wrapper
+
+    def enable(self) -> None:
+        assert Profiler._enabled is None, "Another profiler is already enabled."
+        for base, method, wrap in [(Rule, 'evaluate', self._wrap_rule_evaluate),
+                                   (Titrator, 'evaluate', self._wrap_titrator_evaluate),
+                                   (Titrator, 'evaluate_shared', self._wrap_titrator_evaluate),
+                                   (Titrator, 'evaluate_compiled', self._wrap_titrator_evaluate),
+                                   (Action, 'suggest', self._wrap_action_suggest)]:
+            for cls in _subclasses(base):
+                if method in cls.__dict__:
+                    self._originals.append((cls, method, cls.__dict__[method]))
+                    setattr(cls, method, wrap(cls.__dict__[method]))
+        for base, name, held in [(Titrator, lambda cls: f"{cls.__name__}.compile()", lambda evaluated: bool(evaluated[0])),
+                                 (TitratorGroup, lambda cls, titrator_classes: f"{cls.__name__}.compile({', '.join(c.__name__ for c in titrator_classes)})",
+                                  lambda evaluated: any(satisfied_rules for satisfied_rules, _ in evaluated))]:
+            for cls in _subclasses(base):
+                if 'compile' in cls.__dict__:
+                    self._originals.append((cls, 'compile', cls.__dict__['compile']))
+                    setattr(cls, 'compile', self._wrap_compile(cls.__dict__['compile'], name, held))
+        Profiler._enabled = self
+
+    def disable(self) -> None:
+        for cls, method, original in reversed(self._originals): setattr(cls, method, original)
+        self._originals = []
+        Profiler._enabled = None
+
+    def __enter__(self) -> 'Profiler':
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.disable()
+
+    def reset(self) -> None:
+        self.counters = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'timestamp': time.time(),
+            'counters': [{'kind': kind, 'name': name, **counter.snapshot()} for (kind, name), counter in self.counters.items()],
+        }
+
+    def write_json(self, path : str | Path) -> None:
+        with open(path, "w") as f: json.dump(self.snapshot(), f, indent=2)
+
+    def to_prometheus(self) -> str:
+        "The current counters in the Prometheus text exposition format."
+        def labels(kind, name, **extra):
+            escaped = name.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join([f'kind="{kind}"', f'name="{escaped}"'] + [f'{k}="{v}"' for k, v in extra.items()]) + "}"
+
+        counters = self.snapshot()['counters']
+        lines = []
+        for metric, kind_of_metric, help_text, value in [
+            ('titrations_calls_total', 'counter', "Number of calls.", lambda c: c['calls']),
+            ('titrations_satisfied_total', 'counter', "Number of calls with a satisfied rule.", lambda c: c['satisfied']),
+            ('titrations_seconds_total', 'counter', "Total time spent in calls, in seconds.", lambda c: c['seconds']),
+        ]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind_of_metric}"]
+            lines += [f"{metric}{labels(c['kind'], c['name'])} {value(c)}" for c in counters]
+        lines += ["# HELP titrations_seconds Call duration quantiles over recent calls, in seconds.", "# TYPE titrations_seconds summary"]
+        for c in counters:
+            lines += [f"titrations_seconds{labels(c['kind'], c['name'], quantile=q)} {v}" for q, v in c['quantiles'].items()]
+            lines += [f"titrations_seconds_sum{labels(c['kind'], c['name'])} {c['seconds']}",
+                      f"titrations_seconds_count{labels(c['kind'], c['name'])} {c['calls']}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path : str | Path) -> None:
+        with open(path, "w") as f: f.write(self.to_prometheus())
@@ -0,0 +1,100 @@
+"""
+Resolve titrators by name, building their ladders and rules only on first use.
+
+    from titrations.registry import get_titrator
+    BetaBlockerTitrator = get_titrator("beta_blocker")
+
+Nothing is built at import time. The example titrators are built from `examples.json` through a
+`Catalog`, one at a time, so resolving one titrator builds only its own ladder and rules; the
+consistency checks of `examples.ipynb` keep `examples.json` in step with `examples.py`. Modules
+defining titrator classes can be registered with `register_module`, and are imported on first request.
+"""
+
+__all__ = ['EXAMPLES_CATALOG', 'register', 'register_module', 'register_catalog', 'titrator_names', 'get_titrator', 'measure_import_time']
+
+from pathlib import Path
+from typing import Callable, Dict, List
+
+EXAMPLES_CATALOG = Path(__file__).with_name("examples.json")
+
+_factories : Dict[str, Callable[[], type]] = {}
+_titrators : Dict[str, type] = {}
+
+def register(name : str, factory : Callable[[], type]) -> None:
+    "Register `factory`, which builds and returns a `Titrator` subclass, under `name`."
+    _factories[name] = factory
+    _titrators.pop(name, None)
+
+def register_module(module : str, attributes : Dict[str, str]) -> None:
+    """
+    Register the `Titrator` subclasses `attributes` (registry name to attribute name) of `module`,
+    which is only imported when one of them is first requested.
+    """
+    def factory_for(attribute):
+        def factory():
+            from importlib import import_module
+            return getattr(import_module(module), attribute)
+        return factory
+
+    for name, attribute in attributes.items(): register(name, factory_for(attribute))
+
+def register_catalog(path : str | Path, names : List[str] = None) -> None:
+    """
+    Register the titrators of the JSON or compiled catalog at `path` (all of them unless `names` is
+    given). With `names`, the catalog itself is only loaded when one of them is first requested;
+    otherwise it is loaded now to list them, and its titrators are still built on first request.
+    """
+    catalog = None
+    def load():
+        nonlocal catalog
+        if catalog is None:
+            from .catalog import load_catalog
+            catalog = load_catalog(path)
+        return catalog
+
+    def factory_for(name):
+        def factory():
+            return load().titrator(name)
+        return factory
+
+    for name in load().titrator_names if names is None else names: register(name, factory_for(name))
+
+def titrator_names() -> List[str]:
+    return list(_factories)
+
+def get_titrator(name : str) -> type:
+    "The `Titrator` subclass registered as `name`, built on first request."
+    if name not in _titrators:
+        if name not in _factories: raise KeyError(f"No titrator registered as `{name}`; known titrators are {titrator_names()}.")
+        _titrators[name] = _factories[name]()
+    return _titrators[name]
+
+def measure_import_time(module : str = "titrations.registry", repeat : int = 5) -> Dict[str, float]:
+    """
+    Import `module` in fresh interpreters with `-X importtime` and report the best total import time
+    of the module and of its slowest dependencies, in milliseconds.
+    """
+    import re, subprocess, sys
+    best = {}
+    root = str(Path(__file__).resolve().parent.parent)
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                   capture_output=True, text=True, cwd=root, check=True)
+        for line in completed.stderr.splitlines():
+            match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)", line)
+            if not match: continue
+            cumulative, name = int(match.group(1)) / 1000, match.group(3)
+            best[name] = min(best.get(name, cumulative), cumulative)
+    total = best.pop(module)
+    slowest = dict(sorted(best.items(), key=lambda item: -item[1])[:10])
+    return {'module': module, 'total_ms': total, 'slowest_dependencies_ms': slowest}
+
+register_catalog(EXAMPLES_CATALOG, ['beta_blocker', 'raasi', 'sglt2i', 'mra'])
+
+if __name__ == "__main__":
+    import argparse, json
+    parser = argparse.ArgumentParser(description="Report the import time of a module.")
+    parser.add_argument("module", nargs="?", default="titrations.registry")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(measure_import_time(args.module, args.repeat), indent=2))
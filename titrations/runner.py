@@ -0,0 +1,64 @@
+__all__ = ['TitrationResult', 'evaluate_patient', 'run_titrators']
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional
+import os
+
+from .basics import *
+from .titrations2 import *
+
+class TitrationResult:
+    "A picklable summary of one `Titrator.evaluate` call."
+    __slots__ = ('titrator', 'can_advance', 'satisfied_rules', 'recommended_actions')
+
+    def __init__(self, titrator : str, can_advance : bool, satisfied_rules : List[str], recommended_actions : List[str]) -> None:
+        self.titrator = titrator
+        self.can_advance = can_advance
+        self.satisfied_rules = satisfied_rules
+        self.recommended_actions = recommended_actions
+
+    @classmethod
+    def from_titrator(cls, titrator : Titrator) -> 'TitrationResult':
+        return cls(type(titrator).__name__, titrator.can_advance,
+                   [repr(rule) for rule in titrator.satisfied_rules],
+                   sorted(type(action).__name__ for action in titrator.recommended_actions))
+
+    def __repr__(self) -> str:
+        return f"TitrationResult({self.titrator}, can_advance={self.can_advance}, recommended_actions={self.recommended_actions})"
+
+def evaluate_patient(patient : Patient, titrator_classes : List[type[Titrator]], compiled : bool = True) -> List[TitrationResult]:
+    "Run each of `titrator_classes` on `patient`, evaluating rules they share only once."
+    group = TitratorGroup.from_titrator_types(patient, titrator_classes)
+    group.evaluate(compiled=compiled)
+    return [TitrationResult.from_titrator(titrator) for titrator in group.titrators]
+
+def _evaluate_chunk(patients : List[Patient], titrator_classes : List[type[Titrator]], compiled : bool) -> List[List[TitrationResult]]:
+    return [evaluate_patient(patient, titrator_classes, compiled) for patient in patients]
+
+def _chunks(patients : Iterable[Patient], chunk_size : int) -> Iterator[List[Patient]]:
+    patients = iter(patients)
+    while chunk := list(islice(patients, chunk_size)):
+        yield chunk
+
+def run_titrators(patients : Iterable[Patient],
+                  titrator_classes : List[type[Titrator]],
+                  workers : Optional[int] = None,
+                  chunk_size : int = 256,
+                  compiled : bool = True) -> List[List[TitrationResult]]:
+    """
+    Evaluate every titrator in `titrator_classes` for each patient in the cohort, fanning the work
+    out over `workers` processes (all cores by default) in chunks of `chunk_size` patients.
+    Returns one list of results per patient, in input order.
+    """
+    assert chunk_size > 0, "Chunk size must be positive."
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunks(patients, chunk_size)
+    titrator_classes = list(titrator_classes)
+
+    if workers == 1:
+        return list(chain.from_iterable(_evaluate_chunk(chunk, titrator_classes, compiled) for chunk in chunks))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_evaluate_chunk, chunk, titrator_classes, compiled) for chunk in chunks]
+        return list(chain.from_iterable(future.result() for future in futures))
@@ -0,0 +1,203 @@
+__all__ = ['describe_titrator', 'evaluate_payload', 'evaluate_payloads', 'RecommendationServer', 'LocalClient', 'serve']
+
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .basics import *
+from .titrations2 import *
+from .pipeline import MedicationResolver, patient_from_row, _default_ladders, _default_titrator_classes
+
+# Actions on the patient's current medication, which have nothing to suggest when there is none
+# (e.g. `hypotension` recommends `Continue`/`StepDown`/`MarkMaxDose` for a patient not on the ladder yet)
+_MEDICATION_ACTIONS = (StepUp, StepDown, Continue, Stop, MarkMaxDose, ReportReaction)
+
+def _suggestion(action : Action) -> Optional[str]:
+    if isinstance(action, _MEDICATION_ACTIONS) and action.current_medication is None: return None
+    try:
+        return action.suggest()
+    except IndexError:
+        # `StepUp`/`StepDown` at the end of a ladder have no next step to suggest
+        return None
+
+def describe_titrator(titrator : Titrator) -> Dict[str, Any]:
+    "A JSON-serializable account of an evaluated titrator, including each action's suggestion and buttons."
+    return {
+        'titrator': type(titrator).__name__,
+        'can_advance': titrator.can_advance,
+        'satisfied_rules': [repr(rule) for rule in titrator.satisfied_rules],
+        'actions': [{'action': type(action).__name__, 'suggestion': _suggestion(action), 'buttons': action.buttons()}
+                    for action in titrator.recommended_actions],
+    }
+
+def evaluate_payload(payload : Dict[str, Any], titrator_classes : List[type[Titrator]], resolver : MedicationResolver) -> Dict[str, Any]:
+    "The response to one patient payload (see `pipeline.patient_from_row`)."
+    patient = patient_from_row(payload, resolver)
+    group = TitratorGroup.from_titrator_types(patient, titrator_classes)
+    group.evaluate(compiled=True)
+    return {'id': payload.get('id'), 'recommendations': [describe_titrator(titrator) for titrator in group.titrators]}
+
+def evaluate_payloads(payloads : List[Dict[str, Any]], titrator_classes : List[type[Titrator]],
+                      resolver : MedicationResolver) -> List[Dict[str, Any] | Exception]:
+    "The response to each payload, or the exception evaluating it raised."
+    TitratorGroup.compile(titrator_classes)  # compiled once for the whole batch
+    responses = []
+    for payload in payloads:
+        try: responses.append(evaluate_payload(payload, titrator_classes, resolver))
+        except Exception as e: responses.append(e)
+    return responses
+
+class RecommendationServer:
+    """
+    Collects concurrent `recommend` calls into micro-batches of up to `max_batch_size` requests,
+    waiting at most `max_wait` seconds for a batch to fill, and evaluates each batch through the
+    titrators in one pass in `executor` (the event loop's default executor unless given), so that
+    the event loop keeps accepting requests meanwhile.
+    """
+    def __init__(self,
+                 titrator_classes : Optional[List[type[Titrator]]] = None,
+                 resolver : Optional[MedicationResolver] = None,
+                 max_batch_size : int = 64,
+                 max_wait : float = 0.005,
+                 history : int = 10_000,
+                 executor : Optional[Executor] = None) -> None:
+        assert max_batch_size > 0, "Batch size must be positive."
+        self.titrator_classes = titrator_classes or _default_titrator_classes()
+        self.resolver = resolver or MedicationResolver(_default_ladders())
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self._queue = None
+        self._worker = None
+        self._stopping = False
+        self._batch = []  # the requests taken from the queue and not answered yet
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = deque(maxlen=history)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        "Stop the server; requests that are queued or still being evaluated fail with `RuntimeError`."
+        worker, self._worker = self._worker, None
+        # `asyncio.wait_for` can swallow a cancellation, in which case the worker exits after its batch
+        self._stopping = True
+        worker.cancel()
+        try: await worker
+        except asyncio.CancelledError: pass
+
+        pending = self._batch
+        while not self._queue.empty(): pending.append(self._queue.get_nowait())
+        self._batch = []
+        for _, future, _ in pending:
+            if not future.done(): future.set_exception(RuntimeError("The server was stopped."))
+
+    async def __aenter__(self) -> 'RecommendationServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def recommend(self, payload : Dict[str, Any]) -> Dict[str, Any]:
+        "Recommendations for one patient payload (see `pipeline.patient_from_row`)."
+        if self._worker is None: raise RuntimeError("The server is not running.")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((payload, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> list:
+        # Requests are kept in `_batch` as they are taken, so that `stop` can fail them
+        self._batch = batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0: break
+            try: batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError: break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            batch = await self._next_batch()
+            self._batch_sizes.append(len(batch))
+            responses = await loop.run_in_executor(self.executor, evaluate_payloads,
+                                                   [payload for payload, _, _ in batch], self.titrator_classes, self.resolver)
+            for (payload, future, received), response in zip(batch, responses):
+                if future.done(): continue
+                if isinstance(response, Exception): future.set_exception(response)
+                else:
+                    future.set_result(response)
+                    self._latencies.append(time.perf_counter() - received)
+            self._batch = []
+
+    def evaluate(self, payload : Dict[str, Any]) -> Dict[str, Any]:
+        "The response to one payload, evaluated directly rather than batched."
+        return evaluate_payload(payload, self.titrator_classes, self.resolver)
+
+    def stats(self) -> Dict[str, Any]:
+        "Latency percentiles (in milliseconds) and batch sizes over the most recent requests."
+        latencies = np.array(self._latencies) * 1000
+        batch_sizes = np.array(self._batch_sizes)
+        return {
+            'requests': len(latencies),
+            'batches': len(batch_sizes),
+            'latency_ms': {f'p{q}': float(np.percentile(latencies, q)) for q in (50, 90, 99, 99.9)} if len(latencies) else {},
+            'batch_size': {'mean': float(batch_sizes.mean()), 'max': int(batch_sizes.max())} if len(batch_sizes) else {},
+        }
+
+class LocalClient:
+    "An in-process stand-in for a remote client, calling the server directly."
+    def __init__(self, server : RecommendationServer) -> None:
+        self.server = server
+
+    async def recommend(self, payload : Dict[str, Any]) -> Dict[str, Any]:
+        return await self.server.recommend(payload)
+
+    async def recommend_many(self, payloads : List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await asyncio.gather(*[self.recommend(payload) for payload in payloads])
+
+async def serve(host : str = "127.0.0.1", port : int = 8765, **kwargs) -> None:
+    """
+    Serve recommendations over TCP, one JSON payload per line in and one JSON response per line out.
+    A line containing just `stats` returns the server statistics.
+    """
+    async with RecommendationServer(**kwargs) as server:
+        async def handle(reader, writer):
+            async def respond(line):
+                if line.strip() == b"stats": response = server.stats()
+                else:
+                    try: response = await server.recommend(json.loads(line))
+                    except Exception as e: response = {'error': str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+            pending = set()
+            while line := await reader.readline():
+                task = asyncio.create_task(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending: await asyncio.wait(pending)
+            writer.close()
+
+        tcp_server = await asyncio.start_server(handle, host, port)
+        async with tcp_server:
+            await tcp_server.serve_forever()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve titration recommendations over TCP as JSON lines.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, max_batch_size=args.max_batch_size, max_wait=args.max_wait))
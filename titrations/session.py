@@ -0,0 +1,87 @@
+__all__ = ['dependency_map', 'PatientSession']
+
+from itertools import chain
+from typing import Any, Dict, List, Optional
+
+from .basics import *
+from .titrations2 import *
+
+def dependency_map(rules : List[Rule]) -> Dict[str, List[int]]:
+    "Map each patient attribute to the positions in `rules` of the rules that read it."
+    dependencies = {}
+    for i, rule in enumerate(rules):
+        for parameter in rule.parameters:
+            dependencies.setdefault(parameter, []).append(i)
+    return dependencies
+
+class PatientSession:
+    """
+    Keeps a set of evaluated titrators for one patient and brings them up to date as the patient's
+    parameters change, re-evaluating only the rules that read a changed parameter. A titrator's
+    recommendations are recomputed only when one of its rule outcomes changes.
+    """
+    patient : Patient
+    titrators : List[Titrator]
+
+    def __init__(self, patient : Patient, titrator_classes : List[type[Titrator]]) -> None:
+        self.patient = patient
+        self.titrators = [titrator_class(patient) for titrator_class in titrator_classes]
+        self._results = {}
+        self._dependencies = {}
+        for titrator in self.titrators: self._evaluate(titrator)
+
+    def _evaluate(self, titrator : Titrator) -> None:
+        self._dependencies[id(titrator)] = dependency_map(titrator.rules)
+        self._results[id(titrator)] = [rule.evaluate(self.patient) for rule in titrator.rules]
+        self._recommend(titrator)
+
+    def _recommend(self, titrator : Titrator) -> None:
+        satisfied = [result for result in self._results[id(titrator)] if result.is_satisfied]
+        titrator.recommend([result.rule for result in satisfied], set(chain.from_iterable(result.recommended_actions for result in satisfied)))
+
+    @staticmethod
+    def _outcome(titrator : Titrator) -> tuple:
+        # Rebuilt titrators get a fresh titration target, so rules are compared by their rendering
+        return (tuple(map(repr, titrator.satisfied_rules)), frozenset(type(action) for action in titrator.recommended_actions))
+
+    def update(self, **parameters : Any) -> List[Titrator]:
+        "Set the given patient parameters and return the titrators whose recommendations changed."
+        for parameter, value in parameters.items():
+            assert parameter in VALID_PARAMETERS, "Not a valid parameter"
+            setattr(self.patient, parameter, value)
+
+        changed = []
+        for titrator in self.titrators:
+            dependencies, results = self._dependencies[id(titrator)], self._results[id(titrator)]
+            affected = sorted(set(chain.from_iterable(dependencies.get(parameter, []) for parameter in parameters)))
+            flipped = False
+            for i in affected:
+                result = titrator.rules[i].evaluate(self.patient)
+                if result.is_satisfied != results[i].is_satisfied or \
+                   list(result.recommended_actions) != list(results[i].recommended_actions):
+                    flipped = True
+                results[i] = result
+            if flipped:
+                self._recommend(titrator)
+                changed.append(titrator)
+        return changed
+
+    def update_medications(self,
+                           medications : Optional[List[Medication]] = None,
+                           max_tolerated : Optional[Dict[str, Medication]] = None) -> List[Titrator]:
+        """
+        Replace the patient's medications and/or max tolerated doses. The current ladder step is
+        fixed when a titrator is constructed, so the titrators are rebuilt; returns those whose
+        recommendations changed.
+        """
+        if medications is not None: self.patient.medications = medications
+        if max_tolerated is not None: self.patient.max_tolerated = max_tolerated
+
+        changed = []
+        for i, titrator in enumerate(self.titrators):
+            rebuilt = type(titrator)(self.patient)
+            del self._results[id(titrator)], self._dependencies[id(titrator)]
+            self._evaluate(rebuilt)
+            self.titrators[i] = rebuilt
+            if self._outcome(rebuilt) != self._outcome(titrator): changed.append(rebuilt)
+        return changed
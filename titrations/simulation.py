@@ -0,0 +1,225 @@
+"""
+Multi-visit titration trajectories for whole cohorts, for capacity planning.
+
+    python -m titrations.simulation --patients 100000 --visits 20
+
+At each visit every titrator is evaluated over the cohort with `PatientFrame.evaluate`, the actions
+it recommends are applied to the frame's ladder columns (they are the medication state seen at the
+next visit), and the vitals then move according to their `VitalModel`. The `Trajectory` records the
+step every patient is on, on every ladder, after each visit.
+"""
+
+__all__ = ['VitalModel', 'RandomWalk', 'FlagModel', 'DEFAULT_VITAL_MODELS', 'Trajectory', 'simulate']
+
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .basics import *
+from .titrations2 import *
+from .frame import PatientFrame
+from .pipeline import _default_titrator_classes
+
+class VitalModel(ABC):
+    "The stochastic model of how one parameter changes between visits."
+    parameter : str
+
+    @abstractmethod
+    def advance(self, frame : PatientFrame, rng : np.random.Generator, step_changes : Dict[str, np.ndarray]) -> None:
+        """
+        Update `frame.values[self.parameter]` in place for one visit. `step_changes` holds, for each
+        ladder, how many steps each patient moved at this visit (starting counts as one step up, and
+        stopping as moving down to below the lowest step).
+        """
+
+class RandomWalk(VitalModel):
+    """
+    A numeric parameter that moves by `drift` plus Gaussian noise with standard deviation `scale` at
+    every visit, and by `effects[ladder_name]` for every step a patient moves up that ladder (the
+    opposite for steps down), clipped to `[low, high]`. Missing values stay missing.
+    """
+    def __init__(self, parameter : str, scale : float, drift : float = 0.0, effects : Optional[Dict[str, float]] = None,
+                 low : Optional[float] = None, high : Optional[float] = None) -> None:
+        self.parameter = parameter
+        self.scale = scale
+        self.drift = drift
+        self.effects = effects or {}
+        self.low = low
+        self.high = high
+
+    def advance(self, frame : PatientFrame, rng : np.random.Generator, step_changes : Dict[str, np.ndarray]) -> None:
+        values, valid = frame.values[self.parameter], frame.valid[self.parameter]
+        delta = rng.normal(self.drift, self.scale, frame.size) if self.scale else np.full(frame.size, self.drift)
+        for ladder_name, effect in self.effects.items():
+            if ladder_name in step_changes: delta += effect * step_changes[ladder_name]
+        np.add(values, delta, out=values, where=valid)
+        if self.low is not None or self.high is not None: np.clip(values, self.low, self.high, out=values)
+
+class FlagModel(VitalModel):
+    "A boolean parameter that turns on with probability `onset` and off with probability `resolution` at each visit."
+    def __init__(self, parameter : str, onset : float, resolution : float) -> None:
+        self.parameter = parameter
+        self.onset = onset
+        self.resolution = resolution
+
+    def advance(self, frame : PatientFrame, rng : np.random.Generator, step_changes : Dict[str, np.ndarray]) -> None:
+        values, valid = frame.values[self.parameter], frame.valid[self.parameter]
+        draw = rng.random(frame.size)
+        np.copyto(values, np.where(values, draw >= self.resolution, draw < self.onset), where=valid)
+
+# Illustrative defaults for the example ladders (keyed by their registry names); not clinical estimates.
+DEFAULT_VITAL_MODELS : List[VitalModel] = [
+    RandomWalk('SBP', 5.0, effects={'beta_blocker': -2.0, 'raasi': -3.0, 'sglt2i': -2.0, 'mra': -1.5}, low=60, high=220),
+    RandomWalk('HR', 4.0, effects={'beta_blocker': -4.0}, low=30, high=180),
+    RandomWalk('K', 0.2, effects={'raasi': 0.1, 'mra': 0.15}, low=2.5, high=7.5),
+    RandomWalk('Cr', 0.05, effects={'raasi': 0.02}, low=0.3, high=10),
+    RandomWalk('eGFR', 3.0, effects={'raasi': -1.0, 'sglt2i': -1.0}, low=5, high=130),
+    FlagModel('decompensated', onset=0.02, resolution=0.5),
+    FlagModel('symptomatic', onset=0.03, resolution=0.3),
+]
+
+def _top_steps(ladder : DosingLadder) -> np.ndarray:
+    "The highest step index of each of `ladder.ingredients`, by ingredient code."
+    return np.array([len(ladder.ladder[ingredient.name]) - 1 for ingredient in ladder.ingredients], dtype=np.int16)
+
+def _action_mask(evaluation : 'FrameEvaluation', action : type[Action]) -> np.ndarray:
+    if action not in evaluation.action_types: return np.zeros(len(evaluation.action_bits), dtype=bool)
+    bit = np.uint64(evaluation.action_types.index(action))
+    return ((evaluation.action_bits >> bit) & np.uint64(1)).astype(bool)
+
+class Trajectory:
+    """
+    The steps of a cohort over a simulation: for each ladder, `step[ladder_name]` and
+    `ingredient_code[ladder_name]` are `(visits + 1, patients)` arrays, where row 0 is the cohort
+    before the first visit and -1 means not on the ladder.
+    """
+    def __init__(self, ladders : Dict[str, DosingLadder], visits : int, size : int) -> None:
+        self.ladders = ladders
+        self.visits = visits
+        self.size = size
+        self.step = {name: np.full((visits + 1, size), -1, dtype=np.int16) for name in ladders}
+        self.ingredient_code = {name: np.full((visits + 1, size), -1, dtype=np.int16) for name in ladders}
+        self.top_step = {name: _top_steps(ladder) for name, ladder in ladders.items()}
+
+    def record(self, visit : int, frame : PatientFrame) -> None:
+        for name in self.ladders:
+            self.step[name][visit] = frame.step[name]
+            self.ingredient_code[name][visit] = frame.ingredient_code[name]
+
+    def at_highest_step(self, ladder_name : str) -> np.ndarray:
+        "A `(visits + 1, patients)` mask of whether each patient is on the highest step of their subladder."
+        code, step = self.ingredient_code[ladder_name], self.step[ladder_name]
+        return (code >= 0) & (step == self.top_step[ladder_name][np.maximum(code, 0)])
+
+    def visits_to_highest_step(self, ladder_name : str) -> np.ndarray:
+        "The first visit at which each patient is on the highest step (0 if they started there), or -1 if never."
+        at_highest = self.at_highest_step(ladder_name)
+        return np.where(at_highest.any(axis=0), at_highest.argmax(axis=0), -1)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        "Per-ladder cohort fractions at the last visit, and the distribution of visits needed to reach the highest step."
+        summary = {}
+        for name in self.ladders:
+            visits = self.visits_to_highest_step(name)
+            reached = visits[visits >= 0]
+            summary[name] = {
+                'on_ladder': float((self.ingredient_code[name][-1] >= 0).mean()),
+                'at_highest_step': float(self.at_highest_step(name)[-1].mean()),
+                'reached_highest_step': float(len(reached) / self.size) if self.size else 0.0,
+                'median_visits_to_highest_step': float(np.median(reached)) if len(reached) else None,
+                'visits_to_highest_step': np.bincount(reached, minlength=self.visits + 1).tolist(),
+            }
+        return summary
+
+def _advance_ladder(frame : PatientFrame, ladder_name : str, evaluation : 'FrameEvaluation', top_steps : np.ndarray,
+                    rng : np.random.Generator, step_down_probability : float,
+                    start_ingredients : Optional[Dict[str, str]]) -> np.ndarray:
+    "Apply one visit's recommendations on one ladder; returns how many steps each patient moved."
+    code, step = frame.ingredient_code[ladder_name], frame.step[ladder_name]
+    on_ladder = code >= 0
+    before = np.where(on_ladder, step + 1, 0)
+    at_top = on_ladder & (step == top_steps[np.maximum(code, 0)])
+
+    stop = _action_mask(evaluation, Stop) & on_ladder
+    step_down = _action_mask(evaluation, StepDown) & on_ladder & ~stop & (step > 0) & (rng.random(frame.size) < step_down_probability)
+    step_up = _action_mask(evaluation, StepUp) & on_ladder
+    start = _action_mask(evaluation, Start) & ~on_ladder
+
+    # A patient recommended a step up from the highest step has reached the top of their subladder.
+    top_reached = step_up & at_top
+    frame.max_tolerated_ingredient_code[ladder_name][top_reached] = code[top_reached]
+    frame.max_tolerated_step[ladder_name][top_reached] = step[top_reached]
+    step[step_up & ~at_top] += 1
+    step[step_down] -= 1
+    code[stop], step[stop] = -1, -1
+
+    ingredients = frame.ladders[ladder_name].ingredients
+    if start_ingredients and ladder_name in start_ingredients:
+        codes = [ingredient.name for ingredient in ingredients]
+        code[start] = codes.index(start_ingredients[ladder_name])
+    else:
+        code[start] = rng.integers(0, len(ingredients), int(start.sum()))
+    step[start] = 0
+
+    return np.where(code >= 0, step + 1, 0) - before
+
+def simulate(frame : PatientFrame,
+             titrator_classes : Optional[List[type[Titrator]]] = None,
+             visits : int = 20,
+             vital_models : Optional[List[VitalModel]] = None,
+             step_down_probability : float = 0.0,
+             start_ingredients : Optional[Dict[str, str]] = None,
+             seed : Optional[int] = None) -> Trajectory:
+    """
+    Simulate `visits` visits of `titrator_classes` (the example titrators by default) over a copy of
+    `frame`, whose ladders must include each titrator's dosing ladder.
+
+    At each visit, `StepUp` moves a patient one step up (or, on the highest step, marks it as the
+    maximum tolerated dose), `Start` puts them on the lowest step of `start_ingredients[ladder_name]`
+    (a random ingredient by default), and `Stop` takes them off the ladder. Titration-limiting rules
+    recommend continuing, stepping down or marking the maximum dose; the simulation steps down with
+    `step_down_probability` and otherwise continues without marking, so that a patient held at one
+    visit can titrate again once the limiting condition resolves.
+    """
+    titrator_classes = titrator_classes or _default_titrator_classes()
+    vital_models = DEFAULT_VITAL_MODELS if vital_models is None else vital_models
+    rng = np.random.default_rng(seed)
+
+    frame = frame.copy()
+    ladder_names = [frame._ladder_name(titrator_class.dosing_ladder) for titrator_class in titrator_classes]
+    trajectory = Trajectory({name: frame.ladders[name] for name in ladder_names}, visits, frame.size)
+    trajectory.record(0, frame)
+
+    for visit in range(1, visits + 1):
+        # Rules read only the vitals, so all titrators can be evaluated (sharing rules) before any ladder moves.
+        evaluations = frame.evaluate_all(titrator_classes)
+        step_changes = {name: _advance_ladder(frame, name, evaluations[titrator_class], trajectory.top_step[name], rng,
+                                              step_down_probability, start_ingredients)
+                        for name, titrator_class in zip(ladder_names, titrator_classes)}
+        for model in vital_models: model.advance(frame, rng, step_changes)
+        trajectory.record(visit, frame)
+    return trajectory
+
+if __name__ == "__main__":
+    import argparse
+    from .benchmarks import POOL_SIZE, synthetic_patients
+    from .examples import beta_blocker_ladder, raasi_ladder, sglt2i_ladder, mra_ladder
+
+    parser = argparse.ArgumentParser(description="Simulate titration trajectories of a synthetic cohort.")
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--visits", type=int, default=20)
+    parser.add_argument("--step-down-probability", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ladders = {'beta_blocker': beta_blocker_ladder, 'raasi': raasi_ladder, 'sglt2i': sglt2i_ladder, 'mra': mra_ladder}
+    pool = PatientFrame.from_patients(synthetic_patients(min(args.patients, POOL_SIZE), seed=args.seed), ladders)
+    cohort = pool.take(np.arange(args.patients) % pool.size)
+
+    start = time.perf_counter()
+    trajectory = simulate(cohort, visits=args.visits, step_down_probability=args.step_down_probability, seed=args.seed)
+    seconds = time.perf_counter() - start
+    print(json.dumps({'patients': args.patients, 'visits': args.visits, 'seconds': seconds, 'ladders': trajectory.summary()}, indent=2))
@@ -0,0 +1,146 @@
+__all__ = ['Event', 'PatientTimeline']
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from .basics import *
+from .titrations2 import *
+
+class Event:
+    """
+    One change to a patient's record at `timestamp`. `kind` is one of:
+
+    - `'vitals'`: `payload` maps parameters (see `VALID_PARAMETERS`) to their new values
+    - `'medication'`: `payload` is a `Medication` started, or replacing the one of the same ingredient
+    - `'stop'`: `payload` is the name of the ingredient stopped
+    - `'reaction'`: `payload` is a `Reaction` filed
+    - `'max_tolerated'`: `payload` is the `Medication` marked as maximum tolerated dose
+    """
+    __slots__ = ('timestamp', 'kind', 'payload')
+    kinds = ('vitals', 'medication', 'stop', 'reaction', 'max_tolerated')
+
+    def __init__(self, timestamp : datetime, kind : str, payload : Any) -> None:
+        assert kind in self.kinds, f"Invalid event kind {kind}"
+        if kind == 'vitals':
+            for parameter in payload: assert parameter in VALID_PARAMETERS, "Not a valid parameter"
+        self.timestamp = timestamp
+        self.kind = kind
+        self.payload = payload
+
+    def __repr__(self) -> str:
+        return f"Event({self.timestamp}, {self.kind}, {self.payload!r})"
+
+class _State:
+    "The patient's record after some prefix of the timeline's events."
+    __slots__ = ('parameters', 'medications', 'reactions', 'max_tolerated')
+
+    def __init__(self) -> None:
+        self.parameters = {}
+        self.medications = {}
+        self.reactions = []
+        self.max_tolerated = {}
+
+    def copy(self) -> '_State':
+        state = _State()
+        state.parameters = dict(self.parameters)
+        state.medications = dict(self.medications)
+        state.reactions = list(self.reactions)
+        state.max_tolerated = dict(self.max_tolerated)
+        return state
+
+    def apply(self, event : Event) -> None:
+        if event.kind == 'vitals': self.parameters.update(event.payload)
+        elif event.kind == 'medication': self.medications[event.payload.name] = event.payload
+        elif event.kind == 'stop': self.medications.pop(event.payload, None)
+        elif event.kind == 'reaction': self.reactions.append(event.payload)
+        elif event.kind == 'max_tolerated': self.max_tolerated[event.payload.name] = event.payload
+
+    def to_patient(self) -> Patient:
+        return Patient(medications=list(self.medications.values()), reactions=list(self.reactions),
+                       max_tolerated=dict(self.max_tolerated), **self.parameters)
+
+class PatientTimeline:
+    """
+    An append-only log of a patient's events, with a snapshot of the record taken every
+    `snapshot_interval` events. The patient at any timestamp is materialized from the nearest
+    earlier snapshot by replaying only the events since, and a series of timestamps is served by
+    replaying forward from one to the next.
+    """
+    def __init__(self, events : Iterable[Event] = (), snapshot_interval : int = 64) -> None:
+        assert snapshot_interval > 0, "Snapshot interval must be positive."
+        self.snapshot_interval = snapshot_interval
+        self.events : List[Event] = []
+        self._timestamps = []
+        self._snapshots = [_State()]  # `_snapshots[k]` is the state after the first `k * snapshot_interval` events
+        self._head = _State()
+        for event in events: self.append(event)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def append(self, event : Event) -> None:
+        "Add `event`, which must not be earlier than the last event."
+        if self._timestamps and event.timestamp < self._timestamps[-1]:
+            raise ValueError(f"Event at {event.timestamp} is earlier than the last event ({self._timestamps[-1]}).")
+        self.events.append(event)
+        self._timestamps.append(event.timestamp)
+        self._head.apply(event)
+        if len(self.events) % self.snapshot_interval == 0: self._snapshots.append(self._head.copy())
+
+    def record(self, timestamp : datetime, kind : str, payload : Any) -> Event:
+        event = Event(timestamp, kind, payload)
+        self.append(event)
+        return event
+
+    def record_vitals(self, timestamp : datetime, **parameters : Any) -> Event:
+        return self.record(timestamp, 'vitals', parameters)
+
+    def _count_at(self, timestamp : datetime) -> int:
+        # Events at exactly `timestamp` are included
+        return bisect_right(self._timestamps, timestamp)
+
+    def _state_at(self, count : int) -> _State:
+        if count == len(self.events): return self._head.copy()
+        snapshot = count // self.snapshot_interval
+        state = self._snapshots[snapshot].copy()
+        for event in self.events[snapshot * self.snapshot_interval:count]: state.apply(event)
+        return state
+
+    def patient_at(self, timestamp : datetime) -> Patient:
+        "The patient as recorded at `timestamp`, including events at exactly that time."
+        return self._state_at(self._count_at(timestamp)).to_patient()
+
+    def patients_at(self, timestamps : Iterable[datetime]) -> Iterator[Tuple[datetime, Patient]]:
+        "The patient at each of `timestamps`, which are visited in sorted order."
+        state, count = None, 0
+        for timestamp in sorted(timestamps):
+            target = self._count_at(timestamp)
+            if state is None or target // self.snapshot_interval > count // self.snapshot_interval:
+                # Jumping to a later snapshot replays fewer events than continuing from the last state
+                state, count = self._state_at(target), target
+            for event in self.events[count:target]: state.apply(event)
+            count = target
+            yield timestamp, state.to_patient()
+
+    def change_times(self, start : Optional[datetime] = None, end : Optional[datetime] = None) -> List[datetime]:
+        "The distinct event timestamps between `start` and `end` (inclusive), i.e. the times the record changed."
+        first = 0 if start is None else bisect_left(self._timestamps, start)
+        last = len(self._timestamps) if end is None else self._count_at(end)
+        return list(dict.fromkeys(self._timestamps[first:last]))
+
+    def recommendations(self,
+                        titrator_classes : List[type[Titrator]],
+                        timestamps : Optional[Iterable[datetime]] = None,
+                        start : Optional[datetime] = None,
+                        end : Optional[datetime] = None,
+                        compiled : bool = True) -> Iterator[Tuple[datetime, TitratorGroup]]:
+        """
+        What `titrator_classes` would have recommended at each of `timestamps` (by default, at every
+        time the record changed between `start` and `end`), as evaluated `TitratorGroup`s.
+        """
+        timestamps = self.change_times(start, end) if timestamps is None else timestamps
+        for timestamp, patient in self.patients_at(timestamps):
+            group = TitratorGroup.from_titrator_types(patient, titrator_classes)
+            group.evaluate(compiled=compiled)
+            yield timestamp, group
@@ -177,6 +177,9 @@ class Intolerance:
         "eq": operator.eq,
         "neq": operator.ne,
         "in": operator.contains,
+        "between": within,
+        "in_interval": within,
+        "in_set": within,
     }
     success_actions : List[Action] = []
     failure_actions : List[Action] = []
@@ -189,7 +192,7 @@ class Intolerance:
         assert operation in self.operators, f"Invalid operator {operation}"
         self.parameter = parameter
         self.operation = operation
-        self.threshold = threshold
+        self.threshold = as_predicate(operation, threshold) if operation in PREDICATE_OPERATIONS else threshold
         self.success_actions.extend(additional_success_actions)
         self.failure_actions.extend(additional_failure_actions)
 
@@ -216,7 +219,8 @@ class ConditionalIntolerance(Intolerance):
         assert condition_parameter in VALID_PARAMETERS
         self.condition_parameter = condition_parameter
         self.condition_operation = condition_operation
-        self.condition_threshold = condition_threshold
+        self.condition_threshold = as_predicate(condition_operation, condition_threshold) \
+            if condition_operation in PREDICATE_OPERATIONS else condition_threshold
 
     def condition_is_met(self, patient):
         patient_value = getattr(patient, self.condition_parameter)
@@ -336,17 +340,17 @@ bisoprolol_ladder = DosingLadder([
 
 # %% ../titrations.ipynb 23
 mild_hyperkalemia = NonTitrationLimitingIntolerance(
-    'K', 'in', [n/10 for n in range(51, 56)],
+    'K', 'between', (5.1, 5.5),
     additional_success_actions=[Stop],
     )
 
-# %% ../titrations.ipynb 26
+# %% ../titrations.ipynb 27
 hypotension = TitrationLimitingIntolerance('SBP', 'lt', 90)
 bradycardia = TitrationLimitingIntolerance('HR' , 'lt', 60)  # make it conditional
 decompensation = TitrationLimitingIntolerance('decompensated', 'eq', True)
 symptoms = TitrationLimitingIntolerance('symptomatic', 'eq', True)
 
-# %% ../titrations.ipynb 28
+# %% ../titrations.ipynb 29
 class BetaBlockerTitrator(Titrator):
     intolerances = [
         hypotension,
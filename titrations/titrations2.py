@@ -1,10 +1,11 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../titrations2.ipynb.
 
 # %% auto 0
-__all__ = ['htn_target', 'DosingLadder', 'Rule', 'ConditionalRule', 'Action', 'Start', 'DoNotStart', 'StepUp', 'StepDown',
-           'Continue', 'Stop', 'MarkMaxDose', 'ReportReaction', 'RuleWithActions', 'ConditionalRuleWithActions',
-           'ClassLimitingRule', 'TitrationLimitingRule', 'NonLimitingRule', 'ConditionTitrationLimitingRule',
-           'MaxTolerated', 'Titrator']
+__all__ = ['Columns', 'htn_target', 'DosingLadder', 'columns_from_patients', 'RuleEvalResult', 'Rule', 'ConditionalRule',
+           'Action', 'Start', 'DoNotStart', 'StepUp', 'StepDown', 'Continue', 'Stop', 'MarkMaxDose', 'ReportReaction',
+           'ActionPlan', 'RuleWithActions', 'ConditionalRuleWithActions', 'ClassLimitingRule', 'TitrationLimitingRule',
+           'NonLimitingRule', 'ConditionTitrationLimitingRule', 'RuleEvalResultBatch', 'MaxTolerated', 'compile_rules',
+           'RuleStatistics', 'Titrator', 'TitratorGroup']
 
 # %% ../titrations2.ipynb 1
 from typing import List, Dict, Any, Optional
@@ -25,56 +26,131 @@ class DosingLadder:
         self.ladder = ladder_dict
         # self.ingredient = None
         self.med_class = None
+        self.reindex()
+
+    def reindex(self) -> None:
+        "Rebuild the lookup tables; must be called after `ladder` is modified."
+        self._ingredients = [self.ladder[med_name][0].ingredient for med_name in self.ladder]
+        self._step_index = {}
+        self._next_step_up = {}
+        self._next_step_down = {}
+        for med_name, subladder in self.ladder.items():
+            for i, med in enumerate(subladder):
+                key = (med_name, med.parsed_dose.amount_key)
+                self._step_index.setdefault(key, i)
+                if i + 1 < len(subladder): self._next_step_up.setdefault(key, subladder[i + 1])
+                if i > 0: self._next_step_down.setdefault(key, subladder[i - 1])
+        self._lowest_steps = { med_name : self.ladder[med_name][0] for med_name in self.ladder}
+        self._highest_steps = { med_name : self.ladder[med_name][-1] for med_name in self.ladder}
+        self.version = getattr(self, 'version', 0) + 1
 
     @property
     def ingredients(self) -> List[Ingredient]:
         # TODO this should be okay if the checks in `__init__` are implemented
-        return [self.ladder[med_name][0].ingredient for med_name in self.ladder]
+        return list(self._ingredients)
 
     def get_subladder(self, medication : Ingredient | Medication):
         return self.ladder[medication.name]
 
+    def get_step(self, ingredient_name : str, dose : str) -> Optional[Medication]:
+        "Return the ladder's medication for `ingredient_name` at `dose`, if there is one."
+        index = self._step_index.get((ingredient_name, dose_amount_key(dose)))
+        return None if index is None else self.ladder[ingredient_name][index]
+
     def _get_current_step_index(self, current_med : Medication):
-        subladder = self.get_subladder(current_med)
-        index = next((i for i, med in enumerate(subladder) if med.dose == current_med.dose), None)
-        return index
+        return self._step_index.get((current_med.name, current_med.parsed_dose.amount_key))
     
     def _is_at_lowest_step(self, current_med : Medication):
-        return current_med.dose == self.get_lowest_step(current_med).dose
+        return current_med.parsed_dose.amount_key == self._lowest_steps[current_med.name].parsed_dose.amount_key
 
     def _is_at_highest_step(self, current_med : Medication):
-        return current_med.dose == self.get_highest_step(current_med).dose
+        return current_med.parsed_dose.amount_key == self._highest_steps[current_med.name].parsed_dose.amount_key
     
     def get_next_step_up(self, current_med : Medication):
-        current_dose_index = self._get_current_step_index(current_med)
-        return self.get_subladder(current_med)[current_dose_index + 1]
+        next_step = self._next_step_up.get((current_med.name, current_med.parsed_dose.amount_key))
+        if next_step is None: raise IndexError(f"{current_med} has no step up on the dosing ladder.")
+        return next_step
 
     def get_next_step_down(self, current_med : Medication):
-        current_dose_index = self._get_current_step_index(current_med)
-        return self.get_subladder(current_med)[current_dose_index - 1]
+        next_step = self._next_step_down.get((current_med.name, current_med.parsed_dose.amount_key))
+        if next_step is None: raise IndexError(f"{current_med} has no step down on the dosing ladder.")
+        return next_step
     
+    def get_target_daily_dose(self, medication: Ingredient | Medication) -> Optional[float]:
+        "The total daily dose of the highest step of the medication's subladder."
+        return self._highest_steps[medication.name].daily_dose
+
     def get_lowest_step(self, medication: Ingredient | Medication):
-        return self.get_subladder(medication)[0]
+        return self._lowest_steps[medication.name]
 
     def get_highest_step(self, medication: Ingredient | Medication):
-        return self.get_subladder(medication)[-1]
+        return self._highest_steps[medication.name]
     
     def get_current_medication_for_patient(self, patient : Patient):
-        filtered = list(filter(lambda med: med.ingredient in self.ingredients, patient.medications))
+        # Matched by name rather than identity, so that copies (e.g. unpickled patients) resolve too
+        filtered = [med for med in patient.medications if med.name in self.ladder]
         assert len(filtered) <= 1
         return filtered[0] if filtered else None
     
     @property
     def lowest_steps(self):
-        return { med_name : self.ladder[med_name][0] for med_name in self.ladder}
+        return dict(self._lowest_steps)
     
     @property
     def highest_steps(self):
-        return { med_name : self.ladder[med_name][-1] for med_name in self.ladder}
+        return dict(self._highest_steps)
 
 # %% ../titrations2.ipynb 20
 import operator
 
+# A cohort as one (masked) numpy array per parameter. NumPy dominates import time, so the batch
+# functions import it when first called rather than here.
+Columns = Dict[str, Any]
+
+def _cohort_size(columns : Columns) -> int:
+    sizes = {len(column) for column in columns.values()}
+    assert len(sizes) == 1, "Columns must all have the same length."
+    return sizes.pop()
+
+def _get_column(columns : Columns, parameter : str, size : int):
+    "Return the column for `parameter` as a plain array along with a mask of missing values."
+    import numpy as np
+    if parameter not in columns:
+        return np.full(size, None, dtype=object), np.ones(size, dtype=bool)
+    column = columns[parameter]
+    missing = np.ma.getmaskarray(column)
+    values = np.ma.getdata(column)
+    if values.dtype == object:
+        missing = missing | np.equal(values, None)
+    return values, missing
+
+def columns_from_patients(patients : List[Patient], parameters : List[str] = VALID_PARAMETERS) -> Columns:
+    "Collect `parameters` from `patients` into masked arrays, masking patients who lack a value."
+    import numpy as np
+    columns = {}
+    for parameter in parameters:
+        values = [getattr(patient, parameter, None) for patient in patients]
+        missing = [value is None for value in values]
+        present = [value for value in values if value is not None]
+        dtype = np.asarray(present).dtype if present else object
+        filler = present[0] if present else None
+        columns[parameter] = np.ma.masked_array(
+            np.array([filler if value is None else value for value in values], dtype=dtype),
+            mask=missing)
+    return columns
+
+class RuleEvalResult:
+    "The outcome of evaluating a rule against a single patient."
+    __slots__ = ('rule', 'is_satisfied', 'recommended_actions')
+
+    def __init__(self, rule, is_satisfied : bool, recommended_actions : List[Any] = ()) -> None:
+        self.rule = rule
+        self.is_satisfied = is_satisfied
+        self.recommended_actions = recommended_actions
+
+    def __repr__(self) -> str:
+        return f"RuleEvalResult({self.rule!r}, is_satisfied={self.is_satisfied}, recommended_actions={self.recommended_actions!r})"
+
 class Rule:
     parameter : str
     operation : str
@@ -88,6 +164,9 @@ class Rule:
         "eq": operator.eq,
         "neq": operator.ne,
         "in": operator.contains,
+        "between": within,
+        "in_interval": within,
+        "in_set": within,
     }
 
     def __init__(self, parameter:str, operation:str, threshold:Any) -> None:
@@ -97,7 +176,7 @@ class Rule:
 
         self.parameter = parameter
         self.operation = operation
-        self.threshold = threshold
+        self.threshold = as_predicate(operation, threshold) if operation in PREDICATE_OPERATIONS else threshold
 
     def _is_satisfied(self, patient : Patient):
         # FIXME: handle 'in' operation more neatly
@@ -111,20 +190,47 @@ class Rule:
         # else:
         return self.operators[self.operation](patient_value, self.threshold)
 
-    def _get_eval_result_object(self, is_satisfied : bool, patient : Optional[Patient] = None) -> Any:
-        return type('RuleEvalResult', (), {
-            'rule': self,
-            'is_satisfied': is_satisfied,
-        })
+    def _get_eval_result_object(self, is_satisfied : bool, patient : Optional[Patient] = None) -> RuleEvalResult:
+        return RuleEvalResult(self, is_satisfied)
 
     def evaluate(self, patient : Patient):
         is_satisfied = self._is_satisfied(patient)
         return self._get_eval_result_object(is_satisfied, patient)
+
+    def _is_satisfied_batch(self, columns : Columns, where = None):
+        # Mirrors `_is_satisfied`: missing values are never satisfied, unless the threshold is a
+        # boolean, in which case a missing value among the patients in `where` is an error.
+        import numpy as np
+        size = _cohort_size(columns)
+        where = np.ones(size, dtype=bool) if where is None else where
+        values, missing = _get_column(columns, self.parameter, size)
+        if type(self.threshold) == bool and (missing & where).any():
+            raise ValueError(f"Patient has no attribute `{self.parameter}`.")
+
+        present = where & ~missing
+        mask = np.zeros(size, dtype=bool)
+        if self.operation in PREDICATE_OPERATIONS:
+            mask[present] = self.threshold.mask(values[present])
+        elif self.operation == "in" or values.dtype == object:
+            compare = np.frompyfunc(lambda value: self.operators[self.operation](value, self.threshold), 1, 1)
+            mask[present] = compare(values[present]).astype(bool)
+        else:
+            mask[present] = self.operators[self.operation](values[present], self.threshold)
+        return mask
+
+    def evaluate_batch(self, columns : Columns):
+        "Evaluate the rule over a cohort given as columns keyed by parameter name; returns a boolean mask."
+        return self._is_satisfied_batch(columns)
+
+    @property
+    def parameters(self) -> frozenset:
+        "The patient attributes this rule reads."
+        return frozenset([self.parameter])
     
     def __repr__(self) -> str:
         return f"{self.parameter} {self.operation} {self.threshold}"
 
-# %% ../titrations2.ipynb 24
+# %% ../titrations2.ipynb 26
 class ConditionalRule(Rule):
     condition : Rule
 
@@ -143,8 +249,16 @@ class ConditionalRule(Rule):
         is_satisfied = self._is_satisfied(patient, condition_is_met)
         return self._get_eval_result_object(is_satisfied, patient)
 
+    def evaluate_batch(self, columns : Columns):
+        condition_is_met = self.condition.evaluate_batch(columns)
+        return self._is_satisfied_batch(columns, where=condition_is_met)
+
+    @property
+    def parameters(self) -> frozenset:
+        return super().parameters | self.condition.parameters
 
-# %% ../titrations2.ipynb 29
+
+# %% ../titrations2.ipynb 32
 class Action:
     """
     This is a base class for 'Action' classes to build upon.
@@ -166,7 +280,7 @@ class Action:
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 30
+# %% ../titrations2.ipynb 33
 class Start(Action):
     """
     Start a new medication.
@@ -187,7 +301,7 @@ class Start(Action):
         # TODO: implement this
         pass
 
-# %% ../titrations2.ipynb 33
+# %% ../titrations2.ipynb 36
 class DoNotStart(Action):
     """
     Do not start a new medication.
@@ -199,7 +313,7 @@ class DoNotStart(Action):
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 34
+# %% ../titrations2.ipynb 37
 class StepUp(Action):
     """
     Step up one dose on the dosing ladder.
@@ -211,7 +325,7 @@ class StepUp(Action):
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 35
+# %% ../titrations2.ipynb 38
 class StepDown(Action):
     """
     Step down one dose on the dosing ladder.
@@ -223,7 +337,7 @@ class StepDown(Action):
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 36
+# %% ../titrations2.ipynb 39
 class Continue(Action):
     """
     Continue the medication at the same dose.
@@ -234,7 +348,7 @@ class Continue(Action):
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 37
+# %% ../titrations2.ipynb 40
 class Stop(Action):
     """
     Stop the medication.
@@ -245,7 +359,7 @@ class Stop(Action):
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 38
+# %% ../titrations2.ipynb 41
 class MarkMaxDose(Action):
     """
     Mark current dose as maxiumum tolerated dose.
@@ -256,7 +370,7 @@ class MarkMaxDose(Action):
     def perform(self):
         pass
 
-# %% ../titrations2.ipynb 39
+# %% ../titrations2.ipynb 42
 class ReportReaction(Action):
     """
     File an adverse reaction record.
@@ -270,7 +384,52 @@ class ReportReaction(Action):
             Reaction(self.current_medication.ingredient, description),
         )
 
-# %% ../titrations2.ipynb 41
+# %% ../titrations2.ipynb 44
+def _outcome(rule : Rule, patient : Patient) -> bool:
+    "Whether `rule` is satisfied, without building its result when it evaluates the standard way."
+    evaluate = type(rule).evaluate
+    if evaluate is Rule.evaluate: return rule._is_satisfied(patient)
+    if evaluate is ConditionalRule.evaluate: return rule._is_satisfied(patient, rule._condition_is_met(patient))
+    return rule.evaluate(patient).is_satisfied
+
+class _PlanBranch:
+    __slots__ = ('rule', 'when_satisfied', 'when_not_satisfied')
+
+    def __init__(self, rule : Rule, when_satisfied : Any, when_not_satisfied : Any) -> None:
+        self.rule = rule
+        self.when_satisfied = when_satisfied
+        self.when_not_satisfied = when_not_satisfied
+
+def _unfold(pending : tuple, actions : tuple) -> Any:
+    # A tree testing each nested rule in turn; taking a branch queues that outcome's own nested rules
+    # first, so the leaves list the actions in the order evaluating the rules one by one would.
+    if not pending: return actions
+    rule, rest = pending[0], pending[1:]
+    def branch(plan):
+        if plan is None: return _unfold(rest, actions)  # a rule without actions
+        return _unfold(plan.nested_rules + rest, actions + plan.actions)
+    return _PlanBranch(rule, branch(getattr(rule, '_plan_when_satisfied', None)), branch(getattr(rule, '_plan_when_not_satisfied', None)))
+
+class ActionPlan:
+    """
+    An immutable plan of the actions a rule recommends for one outcome: a fixed tuple of actions,
+    followed by the recommendations of any nested rules. The nested rules' own plans are unfolded at
+    construction into a decision tree whose leaves are the complete tuples of actions, so resolving
+    the plan only tests the nested rules' outcomes to select one of them.
+    """
+    __slots__ = ('actions', 'nested_rules', '_tree')
+
+    def __init__(self, items : List[Any]) -> None:
+        self.actions = tuple(item for item in items if not isinstance(item, Rule))
+        self.nested_rules = tuple(item for item in items if isinstance(item, Rule))
+        self._tree = _unfold(self.nested_rules, self.actions)
+
+    def resolve(self, patient : Patient) -> tuple:
+        node = self._tree
+        while type(node) is _PlanBranch:
+            node = node.when_satisfied if _outcome(node.rule, patient) else node.when_not_satisfied
+        return node
+
 class RuleWithActions(Rule):
     actions_when_satisfied : List[Action] = []
     actions_when_not_satisfied : List[Action] = []
@@ -284,6 +443,12 @@ class RuleWithActions(Rule):
         super().__init__(parameter, operation, threshold)
         self.actions_when_satisfied = self.default_actions_when_satisfied + additional_actions_when_satisfied
         self.actions_when_not_satisfied = self.default_actions_when_not_satisfied + additional_actions_when_not_satisfied
+        self._build_action_plans()
+
+    def _build_action_plans(self) -> None:
+        "Precompute the action plans; must be called again if the action lists (or those of a nested rule) are modified."
+        self._plan_when_satisfied = ActionPlan(self.actions_when_satisfied)
+        self._plan_when_not_satisfied = ActionPlan(self.actions_when_not_satisfied)
 
     def __and__(self, other):
         return RuleCombination([self, other], "and")
@@ -291,26 +456,28 @@ class RuleWithActions(Rule):
     def __or__(self, other):
         return RuleCombination([self, other], "or")
     
+    def __rshift__(self, other):
+        import copy
+        new_rule = copy.deepcopy(self)
+        new_rule.actions_when_not_satisfied.insert(0, other)
+        new_rule._build_action_plans()
+        return new_rule
+    
     def _get_eval_result_object(self, is_satisfied: bool, patient: Patient) -> Any:
         result = super()._get_eval_result_object(is_satisfied, patient)
-
-        recommended_actions = self.actions_when_satisfied if is_satisfied \
-            else self.actions_when_not_satisfied
-        
-        # Recursively evaluate actions that are rules
-        for action in recommended_actions:
-            if isinstance(action, RuleWithActions):
-                action_result = action.evaluate(patient)
-                recommended_actions.remove(action)
-                recommended_actions += action_result.recommended_actions
-
-        result.recommended_actions = recommended_actions
+        plan = self._plan_when_satisfied if is_satisfied else self._plan_when_not_satisfied
+        result.recommended_actions = plan.resolve(patient)
         return result
 
+    @property
+    def parameters(self) -> frozenset:
+        nested_rules = [action for action in self.actions_when_satisfied + self.actions_when_not_satisfied if isinstance(action, Rule)]
+        return super().parameters.union(*[rule.parameters for rule in nested_rules])
+
 class ConditionalRuleWithActions(ConditionalRule, RuleWithActions):
     pass
 
-# %% ../titrations2.ipynb 42
+# %% ../titrations2.ipynb 45
 class ClassLimitingRule(RuleWithActions):
     default_actions_when_satisfied = [Stop, ReportReaction]
 
@@ -320,34 +487,286 @@ class TitrationLimitingRule(RuleWithActions):
 class NonLimitingRule(RuleWithActions):
     pass
 
-# %% ../titrations2.ipynb 43
+# %% ../titrations2.ipynb 46
 class ConditionTitrationLimitingRule(ConditionalRule, TitrationLimitingRule):
     def _get_eval_result_object(self, is_satisfied: bool, patient: Patient) -> Any:
         # TODO: this is not a neat solution, will need to think of a better way
         return TitrationLimitingRule._get_eval_result_object(self, is_satisfied, patient)
 
-# %% ../titrations2.ipynb 55
+# %% ../titrations2.ipynb 52
+class RuleEvalResultBatch:
+    """
+    Compact, contiguous storage for the evaluation results of a set of rules over many patients.
+    Each row holds a patient index, a rule id (the rule's position in `rules`) and the satisfied
+    flag; the recommended actions are stored as a bitmask over `action_types`.
+    """
+    rules : List[Rule]
+    action_types : List[type[Action]]
+
+    def __init__(self, rules : List[Rule], capacity : int = 1024) -> None:
+        import numpy as np
+        self.rules = list(rules)
+        self._rule_ids = {id(rule): i for i, rule in enumerate(self.rules)}
+        self.action_types = []
+        self._action_codes = {}
+        self._size = 0
+        self.patient_index = np.empty(capacity, dtype=np.int64)
+        self.rule_id = np.empty(capacity, dtype=np.int32)
+        self.is_satisfied = np.empty(capacity, dtype=bool)
+        self.action_bits = np.empty(capacity, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, extra : int) -> None:
+        capacity = len(self.rule_id)
+        if self._size + extra <= capacity: return
+        while capacity < self._size + extra: capacity *= 2
+        import numpy as np
+        for name in ('patient_index', 'rule_id', 'is_satisfied', 'action_bits'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def _encode_actions(self, actions : List[type[Action]]) -> int:
+        bits = 0
+        for action in actions:
+            if action not in self._action_codes:
+                assert len(self.action_types) < 64, "Too many distinct action types."
+                self._action_codes[action] = len(self.action_types)
+                self.action_types.append(action)
+            bits |= 1 << self._action_codes[action]
+        return bits
+
+    def _decode_actions(self, bits : int) -> List[type[Action]]:
+        return [action for code, action in enumerate(self.action_types) if bits >> code & 1]
+
+    def append(self, patient_index : int, result : RuleEvalResult) -> None:
+        self._reserve(1)
+        i = self._size
+        self.patient_index[i] = patient_index
+        self.rule_id[i] = self._rule_ids[id(result.rule)]
+        self.is_satisfied[i] = result.is_satisfied
+        self.action_bits[i] = self._encode_actions(result.recommended_actions)
+        self._size += 1
+
+    def extend_from_mask(self, rule : Rule, mask) -> None:
+        "Append one row per patient from a mask returned by `rule.evaluate_batch`."
+        import numpy as np
+        # Nested rules (e.g. added with `>>`, which go in `actions_when_not_satisfied`) depend on more than the mask
+        assert not any(isinstance(action, Rule) for action in
+                       getattr(rule, 'actions_when_satisfied', []) + getattr(rule, 'actions_when_not_satisfied', [])), \
+            "Rules with nested rule actions must be appended one result at a time."
+        count = len(mask)
+        self._reserve(count)
+        rows = slice(self._size, self._size + count)
+        self.patient_index[rows] = np.arange(count)
+        self.rule_id[rows] = self._rule_ids[id(rule)]
+        self.is_satisfied[rows] = mask
+        self.action_bits[rows] = np.where(mask,
+            self._encode_actions(getattr(rule, 'actions_when_satisfied', [])),
+            self._encode_actions(getattr(rule, 'actions_when_not_satisfied', [])))
+        self._size += count
+
+    def __getitem__(self, i : int) -> RuleEvalResult:
+        if not -self._size <= i < self._size: raise IndexError(i)
+        i %= self._size
+        return RuleEvalResult(self.rules[self.rule_id[i]], bool(self.is_satisfied[i]),
+                              self._decode_actions(int(self.action_bits[i])))
+
+    def for_patient(self, patient_index : int) -> List[RuleEvalResult]:
+        import numpy as np
+        rows = np.flatnonzero(self.patient_index[:self._size] == patient_index)
+        return [self[int(i)] for i in rows]
+
+# %% ../titrations2.ipynb 64
 class MaxTolerated(RuleWithActions):
     actions_when_satisfied = [Continue]
     def __init__(self, dosing_ladder : DosingLadder, current_medication : Optional[Medication] = None) -> None:
         self.dosing_ladder = dosing_ladder
         self.current_medication = current_medication
+        self._build_action_plans()
 
     def _is_satisfied(self, patient: Patient):
         if not self.current_medication: self.current_medication = self.dosing_ladder.get_current_medication_for_patient(patient)
         if self.current_medication and self.current_medication.name in patient.max_tolerated:
-            return str(self.current_medication) == str(patient.max_tolerated[self.current_medication.name])
+            max_tolerated = patient.max_tolerated[self.current_medication.name]
+            return max_tolerated is self.current_medication or self.current_medication.key == max_tolerated.key
         return False
     
+    @property
+    def parameters(self) -> frozenset:
+        return frozenset(['medications', 'max_tolerated'])
+
     def __repr__(self) -> str:
         return "Max tolerated dose?"
 
-# %% ../titrations2.ipynb 57
+# %% ../titrations2.ipynb 66
 htn_target = RuleWithActions('SBP', 'lt', 130, additional_actions_when_satisfied=[Continue])
 
-# %% ../titrations2.ipynb 59
+# %% ../titrations2.ipynb 68
+import math
+from itertools import chain
+from typing import Callable, Tuple
+
+_comparison_symbols = {
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+    "eq": "==",
+    "neq": "!=",
+}
+
+def _raise_missing(parameter : str):
+    raise ValueError(f"Patient has no attribute `{parameter}`.")
+
+def _is_inlinable(rule : Rule) -> bool:
+    "Whether `rule` is a plain comparison (optionally conditional) whose satisfied actions contain no nested rules."
+    if type(rule)._is_satisfied not in (Rule._is_satisfied, ConditionalRule._is_satisfied): return False
+    if isinstance(rule, ConditionalRule) and not _is_inlinable(rule.condition): return False
+    actions = getattr(rule, 'actions_when_satisfied', [])
+    return not any(isinstance(action, Rule) for action in actions)
+
+class _RuleCompiler:
+    def __init__(self) -> None:
+        self.namespace = {'_raise_missing': _raise_missing}
+        self.parameters = {}
+
+    def bind(self, prefix : str, obj : Any) -> str:
+        name = f"{prefix}_{len(self.namespace)}"
+        self.namespace[name] = obj
+        return name
+
+    def value_of(self, parameter : str) -> str:
+        if parameter not in self.parameters: self.parameters[parameter] = f"value_{len(self.parameters)}"
+        return self.parameters[parameter]
+
+    def literal(self, threshold : Any) -> str:
+        # The repr of a non-finite float (`inf`, `nan`) is not a valid literal
+        if type(threshold) in (int, bool, str) or (type(threshold) is float and math.isfinite(threshold)): return repr(threshold)
+        return self.bind('threshold', threshold)
+
+    def expression(self, rule : Rule) -> str:
+        value = self.value_of(rule.parameter)
+        if rule.operation in ("between", "in_interval"):
+            upper = "<=" if rule.threshold.closed_right else "<"
+            comparison = f"{self.literal(rule.threshold.low)} <= {value} {upper} {self.literal(rule.threshold.high)}"
+        elif rule.operation == "in_set": comparison = f"{value} in {self.literal(rule.threshold.values)}"
+        elif rule.operation == "in": comparison = f"{self.literal(rule.threshold)} in {value}"
+        else: comparison = f"{value} {_comparison_symbols[rule.operation]} {self.literal(rule.threshold)}"
+
+        if type(rule.threshold) == bool: expression = f"(_raise_missing({rule.parameter!r}) if {value} is None else {comparison})"
+        else: expression = f"({value} is not None and {comparison})"
+
+        if isinstance(rule, ConditionalRule): expression = f"({self.expression(rule.condition)} and {expression})"
+        return expression
+
+    def compile(self, rules : List[Rule]) -> Callable:
+        body = []
+        for rule in rules:
+            name = self.bind('rule', rule)
+            if _is_inlinable(rule):
+                actions = self.bind('actions', tuple(getattr(rule, 'actions_when_satisfied', [])))
+                body += [f"    if {self.expression(rule)}:",
+                         f"        satisfied.append({name})",
+                         f"        actions.extend({actions})"]
+            else:
+                body += [f"    result = {name}.evaluate(patient)",
+                         f"    if result.is_satisfied:",
+                         f"        satisfied.append({name})",
+                         f"        actions.extend(result.recommended_actions)"]
+
+        lines = ["def evaluate_rules(patient):"]
+        lines += [f"    {value} = getattr(patient, {parameter!r}, None)" for parameter, value in self.parameters.items()]
+        lines += ["    satisfied = []", "    actions = []"] + body
+        lines += ["    return satisfied, list(dict.fromkeys(actions))"]
+        exec("\n".join(lines), self.namespace)
+        return self.namespace['evaluate_rules']
+
+    def compile_group(self, rule_lists : List[List[Rule]]) -> Callable:
+        # Evaluate each distinct rule once into a local flag, then assemble the result of every list from the flags.
+        flags, body = {}, []
+        for rule in dict.fromkeys(chain.from_iterable(rule_lists)):
+            name = flags[rule] = self.bind('rule', rule)
+            if _is_inlinable(rule):
+                body += [f"    {name}_satisfied = {self.expression(rule)}"]
+            else:
+                body += [f"    {name}_result = {name}.evaluate(patient)",
+                         f"    {name}_satisfied = {name}_result.is_satisfied"]
+
+        for i, rules in enumerate(rule_lists):
+            body += [f"    satisfied_{i} = []", f"    actions_{i} = []"]
+            for rule in rules:
+                name = flags[rule]
+                actions = self.bind('actions', tuple(getattr(rule, 'actions_when_satisfied', []))) if _is_inlinable(rule) \
+                    else f"{name}_result.recommended_actions"
+                body += [f"    if {name}_satisfied:",
+                         f"        satisfied_{i}.append({name})",
+                         f"        actions_{i}.extend({actions})"]
+
+        lines = ["def evaluate_rule_lists(patient):"]
+        lines += [f"    {value} = getattr(patient, {parameter!r}, None)" for parameter, value in self.parameters.items()]
+        lines += body
+        lines += ["    return [" + ", ".join(f"(satisfied_{i}, list(dict.fromkeys(actions_{i})))" for i in range(len(rule_lists))) + "]"]
+        exec("\n".join(lines), self.namespace)
+        return self.namespace['evaluate_rule_lists']
+
+def compile_rules(rules : List[Rule]) -> Callable[[Patient], Tuple[List[Rule], List[type[Action]]]]:
+    """
+    Generate a single function evaluating `rules` against a patient, returning the satisfied rules
+    and the (deduplicated) action classes they recommend. Plain comparisons are inlined; any other
+    rule falls back to its own `evaluate`.
+    """
+    return _RuleCompiler().compile(rules)
+
+# %% ../titrations2.ipynb 72
+from time import perf_counter
+
+class RuleStatistics:
+    "Running counts of how often a rule was evaluated, how often it was satisfied, and how long it took."
+    __slots__ = ('calls', 'satisfied', 'seconds')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.satisfied = 0
+        self.seconds = 0.0
+
+    def record(self, is_satisfied : bool, seconds : float) -> None:
+        self.calls += 1
+        self.satisfied += is_satisfied
+        self.seconds += seconds
+
+    @property
+    def hit_rate(self) -> float:
+        return self.satisfied / self.calls if self.calls else 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.seconds / self.calls if self.calls else 0.0
+
+    @property
+    def rank(self) -> float:
+        # Expected cost of finding a satisfied rule: cheap rules that are often satisfied go first,
+        # and rules that have not been observed yet go first so that they are measured.
+        if not self.calls: return 0.0
+        return self.mean_seconds / max(self.hit_rate, 1e-6)
+
+class _SelectivityState:
+    def __init__(self, rules : tuple) -> None:
+        self.rules = rules
+        self.statistics = [RuleStatistics() for _ in range(len(rules) + 1)]  # the titration target comes last
+        self.order = list(range(len(self.statistics)))
+        self.calls = 0
+
+    def reorder(self) -> None:
+        self.order.sort(key=lambda i: self.statistics[i].rank)
+
+# %% ../titrations2.ipynb 73
 from inspect import isclass
 from itertools import chain
+from time import perf_counter
 
 class Titrator:
     patient : Patient
@@ -362,6 +781,7 @@ class Titrator:
     default_titration_rules : List[RuleWithActions]
     default_initiation_actions : List[Action] = [Start]
     default_titration_actions : List[Action] = [StepUp]
+    reorder_interval : int = 1024  # `decide` calls between rule reorderings
     
     # instance attributes
     titration_target : Rule
@@ -399,6 +819,34 @@ class Titrator:
         self.initiation_actions = self.default_initiation_actions  # TODO: allow override
         self.titration_actions = self.default_titration_actions  # TODO: allow override
 
+    @classmethod
+    def compile(cls) -> Callable[[Patient], Tuple[List[Rule], List[type[Action]]]]:
+        "Compile `default_rules` with `compile_rules`, caching the result on the class until the rules change."
+        rules = tuple(cls.default_rules)
+        cached = cls.__dict__.get('_compiled_rules')
+        if cached is None or cached[0] != rules:
+            cached = (rules, compile_rules(list(rules)))
+            cls._compiled_rules = cached
+        return cached[1]
+
+    @classmethod
+    def _selectivity_state(cls) -> _SelectivityState:
+        rules = tuple(cls.default_rules)
+        state = cls.__dict__.get('_selectivity')
+        if state is None or state.rules != rules:
+            state = _SelectivityState(rules)
+            cls._selectivity = state
+        return state
+
+    @classmethod
+    def selectivity_statistics(cls) -> List[Dict[str, Any]]:
+        "Per-rule statistics gathered by `decide`, in the order rules are currently evaluated."
+        state = cls._selectivity_state()
+        names = [repr(rule) for rule in state.rules] + ['titration target']
+        return [{'rule': names[i], 'calls': state.statistics[i].calls, 'satisfied': state.statistics[i].satisfied,
+                 'hit_rate': state.statistics[i].hit_rate, 'mean_seconds': state.statistics[i].mean_seconds}
+                for i in state.order]
+
     @property
     def current_ingredient(self) -> Ingredient:
         return self.current_medication.ingredient if self.current_medication else None
@@ -411,11 +859,64 @@ class Titrator:
     def is_titrating(self) -> bool:
         return not self.is_initiating
     
-    def evaluate(self) -> None:
+    def evaluate_compiled(self, evaluated : Optional[Tuple[List[Rule], List[type[Action]]]] = None) -> None:
+        """
+        Like `evaluate`, but with the function generated by `compile`. `evaluated` can instead give
+        this titrator's part of the output of a function compiled by `TitratorGroup.compile`.
+        """
+        satisfied_rules, actions = evaluated if evaluated is not None else self.compile()(self.patient)
+        target_result = self.titration_target.evaluate(self.patient)
+        if target_result.is_satisfied:
+            satisfied_rules = satisfied_rules + [self.titration_target]
+            actions = actions + [action for action in target_result.recommended_actions if action not in actions]
+        self.recommend(satisfied_rules, actions)
+
+    def decide(self) -> bool:
+        """
+        Determine only `can_advance`, stopping at the first satisfied rule. Rules are tried in order of
+        their observed cost and hit rate, which is refreshed every `reorder_interval` calls. Use
+        `evaluate` when the satisfied rules and recommended actions are needed.
+        """
+        state = self._selectivity_state()
+        is_satisfied = False
+        for i in state.order:
+            start = perf_counter()
+            is_satisfied = self.rules[i].evaluate(self.patient).is_satisfied
+            state.statistics[i].record(is_satisfied, perf_counter() - start)
+            if is_satisfied: break
+
+        state.calls += 1
+        if state.calls % self.reorder_interval == 0: state.reorder()
+        self.can_advance = not is_satisfied
+        return self.can_advance
+
+    def evaluate(self, compiled : bool = False) -> None:
+        "Evaluate the rules and set `satisfied_rules`, `can_advance` and `recommended_actions`."
+        if compiled: return self.evaluate_compiled()
+
         self._rule_results = map(lambda rule: rule.evaluate(self.patient), self.rules)
         self._results_satisfied = list(filter(lambda result: result.is_satisfied, self._rule_results))
-        self.satisfied_rules = list(map(lambda result: result.rule, self._results_satisfied))
-        
+        satisfied_rules = list(map(lambda result: result.rule, self._results_satisfied))
+        action_lists = [result.recommended_actions for result in self._results_satisfied]
+        self.recommend(satisfied_rules, set(chain.from_iterable(action_lists)))
+
+    def evaluate_shared(self, rule_results : Dict[Rule, RuleEvalResult]) -> None:
+        """
+        Like `evaluate`, but looking results up in (and adding them to) `rule_results`, so that
+        titrators sharing rules can share their results for the same patient.
+        """
+        self._rule_results = [rule_results[rule] if rule in rule_results else
+                              rule_results.setdefault(rule, rule.evaluate(self.patient)) for rule in self.rules]
+        self._results_satisfied = [result for result in self._rule_results if result.is_satisfied]
+        satisfied_rules = [result.rule for result in self._results_satisfied]
+        self.recommend(satisfied_rules, set(chain.from_iterable(result.recommended_actions for result in self._results_satisfied)))
+
+    def recommend(self, satisfied_rules : List[Rule], action_classes : List[type[Action]]) -> None:
+        """
+        Set `satisfied_rules`, `can_advance` and `recommended_actions` from rules found satisfied
+        (by one of the `evaluate` methods, or from a cached outcome) and the actions they call for.
+        """
+        self.satisfied_rules = satisfied_rules
         self.can_advance = len(self.satisfied_rules) == 0
 
         if self.can_advance:
@@ -424,9 +925,64 @@ class Titrator:
             else:
                 self.recommended_actions = [action(self.patient, self.dosing_ladder, self.current_medication) for action in self.titration_actions]
         else:
-            action_lists = [result.recommended_actions for result in self._results_satisfied]
             self.recommended_actions = [action(
                 self.patient, self.dosing_ladder, self.current_medication
-                ) for action in set(chain.from_iterable(action_lists))]
+                ) for action in action_classes]
 
+# %% ../titrations2.ipynb 87
+class TitratorGroup:
+    """
+    Titrators of several classes evaluated together for one patient. Rules shared between the
+    classes (e.g. `low_egfr` in the example RAASi, SGLT2i and MRA titrators) are evaluated only once.
+    """
+    patient : Patient
+    titrators : List[Titrator]
+    rule_results : Dict[Rule, RuleEvalResult]
+
+    def __init__(self, patient : Patient, titrators : List[Titrator]) -> None:
+        self.patient = patient
+        self.titrators = titrators
+
+    @classmethod
+    def from_titrator_types(cls, patient : Patient, titrator_classes : List[type[Titrator]]) -> 'TitratorGroup':
+        return cls(patient, [titrator_class(patient) for titrator_class in titrator_classes])
+
+    @staticmethod
+    def shared_rules(titrator_classes : List[type[Titrator]]) -> List[Rule]:
+        "The distinct `default_rules` of `titrator_classes`, in first-seen order."
+        return list(dict.fromkeys(chain.from_iterable(titrator_class.default_rules for titrator_class in titrator_classes)))
+
+    @classmethod
+    def compile(cls, titrator_classes : List[type[Titrator]]) -> Callable[[Patient], List[Tuple[List[Rule], List[type[Action]]]]]:
+        """
+        Compile the `default_rules` of `titrator_classes` into one function evaluating each distinct rule
+        once and returning the satisfied rules and recommended action classes of every class, in order.
+        The function is cached on `TitratorGroup` per tuple of classes until their rules change.
+        """
+        key = tuple(titrator_classes)
+        rule_lists = tuple(tuple(titrator_class.default_rules) for titrator_class in titrator_classes)
+        cache = cls.__dict__.get('_compiled_groups')
+        if cache is None: cache = cls._compiled_groups = {}
+        cached = cache.get(key)
+        if cached is None or cached[0] != rule_lists:
+            cached = cache[key] = (rule_lists, _RuleCompiler().compile_group([list(rules) for rules in rule_lists]))
+        return cached[1]
+
+    def evaluate(self, compiled : bool = False) -> None:
+        "Evaluate every titrator; see `Titrator.evaluate`."
+        if compiled:
+            evaluated = self.compile([type(titrator) for titrator in self.titrators])(self.patient)
+            for titrator, titrator_evaluated in zip(self.titrators, evaluated):
+                titrator.evaluate_compiled(titrator_evaluated)
+        else:
+            self.rule_results = {}
+            for titrator in self.titrators:
+                titrator.evaluate_shared(self.rule_results)
+
+    @property
+    def can_advance(self) -> bool:
+        return all(titrator.can_advance for titrator in self.titrators)
 
+    @property
+    def recommended_actions(self) -> List[Action]:
+        return list(chain.from_iterable(titrator.recommended_actions for titrator in self.titrators))